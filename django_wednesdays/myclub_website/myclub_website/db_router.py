@@ -0,0 +1,23 @@
+import random
+
+from django.conf import settings
+
+
+# https://docs.djangoproject.com/en/4.2/topics/db/multi-db/#database-routers
+class ReplicaRouter:
+    def replicas(self):
+        return [name for name in settings.DATABASES if name.startswith('replica_')]
+
+    def db_for_read(self, model, **hints):
+        replicas = self.replicas()
+        return random.choice(replicas) if replicas else 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # all databases have the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
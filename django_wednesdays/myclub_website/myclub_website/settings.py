@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from django.db.backends.signals import connection_created
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -74,14 +77,63 @@ WSGI_APPLICATION = 'myclub_website.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# from environment:
+# DB_ENGINE    django.db.backends.sqlite3 (default) or postgresql, mysql ...
+# DB_NAME      file for sqlite, database name for others
+# DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+# DB_REPLICAS  read replicas, comma separated: files for sqlite, hosts for others
+DB_ENGINE = os.environ.get('DB_ENGINE', 'django.db.backends.sqlite3')
+DB_SQLITE = DB_ENGINE.endswith('sqlite3')
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'ENGINE': DB_ENGINE,
+        'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+        'USER': os.environ.get('DB_USER', ''),
+        'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+        'HOST': os.environ.get('DB_HOST', ''),
+        'PORT': os.environ.get('DB_PORT', ''),
+        # keep connections between requests instead of opening one per request
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+        # seconds to wait for a lock before "database is locked"
+        'OPTIONS': {'timeout': 30} if DB_SQLITE else {},
+    }
+}
+
+for i, replica in enumerate(r for r in os.environ.get('DB_REPLICAS', '').split(',') if r):
+    DATABASES[f'replica_{i}'] = {
+        **DATABASES['default'],
+        ('NAME' if DB_SQLITE else 'HOST'): replica,
+        # tests use default instead of the replica
+        'TEST': {'MIRROR': 'default'},
     }
+
+# reads go to replicas, writes and migrations to default
+DATABASE_ROUTERS = ['myclub_website.db_router.ReplicaRouter']
+
+# SQLite settings for many threads, set on every new connection
+# https://www.sqlite.org/wal.html
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -20000,
+    'mmap_size': 256 * 1024 * 1024,
+    'busy_timeout': 30000,
+    'temp_store': 'MEMORY',
 }
 
 
+def sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for name, value in SQLITE_PRAGMAS.items():
+                cursor.execute(f'PRAGMA {name} = {value}')
+
+
+connection_created.connect(sqlite_pragmas)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -1,16 +1,230 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+# Logging without disk io on the request thread
+# views put records into a bounded queue (QueueHandler), one listener thread
+# takes them out in batches and writes every batch with one write + flush
+# the thread starts with the first record of every process, so workers
+# forked from a preloaded app (gunicorn --preload) get their own
+#
+# settings from environment:
+# LOG_FILE            file.log
+# LOG_QUEUE_SIZE      max records waiting in the queue
+# LOG_FULL_POLICY     'drop' - lose the record, 'block' - wait for free place
+# LOG_BATCH_SIZE      max records in one write
+# LOG_FLUSH_INTERVAL  seconds, records are written not later than this
+# LOG_MAX_BYTES       rotate file on this size, 0 - never (default)
+# LOG_ROTATE_SECONDS  rotate file on this age, 0 - never (default)
+# LOG_BACKUP_COUNT    old files to keep
+# LOG_JSON            1 - one json object per line in the file
+#
+# with more than one worker process (gunicorn, uvicorn --workers) keep the
+# rotation off: every process would rotate the shared file on its own and
+# rename the others' files; rotate with logrotate instead, the file is
+# opened again when it was moved or removed (like WatchedFileHandler)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {'time': self.formatTime(record),
+                'level': record.levelname,
+                'name': record.name,
+                'file': record.filename,
+                'message': record.getMessage()}
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, q, policy='drop', block_timeout=1.0, start=None):
+        super().__init__(q)
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        # called before every record, starts the listener of this process
+        self.start = start
+
+    def enqueue(self, record):
+        if self.start is not None:
+            self.start()
+        try:
+            if self.policy == 'block':
+                self.queue.put(record, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchFileHandler(logging.handlers.RotatingFileHandler):
+    # rotate by size and by age, write a list of records at once
+    def __init__(self, filename, max_bytes=0, backup_count=0, rotate_seconds=0, encoding='utf-8'):
+        super().__init__(filename, 'a', max_bytes, backup_count, encoding, delay=True)
+        self.rotate_seconds = rotate_seconds
+        self.rollover_at = self._next_rollover()
+        # (device, inode) of the open file
+        self.file_id = None
+
+    def _open(self):
+        stream = super()._open()
+        stat = os.fstat(stream.fileno())
+        self.file_id = (stat.st_dev, stat.st_ino)
+        return stream
+
+    def _moved(self):
+        # logrotate renamed or removed the file
+        try:
+            stat = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            return True
+        return (stat.st_dev, stat.st_ino) != self.file_id
+
+    def _next_rollover(self):
+        return time.time() + self.rotate_seconds if self.rotate_seconds else None
+
+    def _should_rotate(self, size):
+        if self.rollover_at and time.time() >= self.rollover_at:
+            return True
+        if self.maxBytes and self.stream is not None:
+            return self.stream.tell() + size >= self.maxBytes
+        return False
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = self._next_rollover()
+
+    def emit_batch(self, records):
+        data = ''.join(self.format(r) + self.terminator for r in records)
+        self.acquire()
+        try:
+            if self.stream is not None and self._moved():
+                self.stream.close()
+                self.stream = None
+            if self.stream is None:
+                self.stream = self._open()
+            if self._should_rotate(len(data)):
+                self.doRollover()
+                if self.stream is None:
+                    self.stream = self._open()
+            self.stream.write(data)
+            self.stream.flush()
+        except Exception:
+            self.handleError(records[-1])
+        finally:
+            self.release()
+
+
+class BatchQueueListener(logging.handlers.QueueListener):
+    def __init__(self, q, *handlers, batch_size=100, flush_interval=1.0):
+        super().__init__(q, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+    def handle_batch(self, records):
+        for handler in self.handlers:
+            batch = [r for r in records if r.levelno >= handler.level]
+            if not batch:
+                continue
+            if hasattr(handler, 'emit_batch'):
+                handler.emit_batch(batch)
+            else:
+                for record in batch:
+                    handler.handle(record)
+
+    def _monitor(self):
+        q = self.queue
+        stop = False
+        while not stop:
+            try:
+                records = [q.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            # take what is already waiting, up to batch size
+            while len(records) < self.batch_size:
+                try:
+                    records.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            if records[-1] is self._sentinel:
+                records.pop()
+                stop = True
+            elif self._sentinel in records:
+                records = [r for r in records if r is not self._sentinel]
+                stop = True
+            if records:
+                self.handle_batch(records)
 
 
 class MakeLog:
     logger = logging.getLogger()
 
+    file_name = os.environ.get('LOG_FILE', 'file.log')
+    queue_size = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+    full_policy = os.environ.get('LOG_FULL_POLICY', 'drop')
+    batch_size = int(os.environ.get('LOG_BATCH_SIZE', 100))
+    flush_interval = float(os.environ.get('LOG_FLUSH_INTERVAL', 1.0))
+    max_bytes = int(os.environ.get('LOG_MAX_BYTES', 0))
+    rotate_seconds = int(os.environ.get('LOG_ROTATE_SECONDS', 0))
+    backup_count = int(os.environ.get('LOG_BACKUP_COUNT', 5))
+    json_lines = os.environ.get('LOG_JSON') == '1'
+
     c_handler = logging.StreamHandler()
     c_format = logging.Formatter("%(levelname)s - %(name)s - %(filename)s - %(message)s")
-    logger.addHandler(c_handler)
+    c_handler.setFormatter(c_format)
+
+    handler = BatchFileHandler(file_name, max_bytes, backup_count, rotate_seconds)
+    if json_lines:
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(
+            logging.Formatter(u"%(asctime)s : %(levelname)s - %(name)s - %(filename)s - %(message)s"))
+
+    log_queue = queue.Queue(queue_size)
+    queue_handler = BoundedQueueHandler(log_queue, full_policy)
+    listener = BatchQueueListener(log_queue, c_handler, handler,
+                                  batch_size=batch_size, flush_interval=flush_interval)
+    # process the listener thread runs in
+    pid = None
+    start_lock = threading.Lock()
 
     # logger.setLevel(logging.DEBUG)  # or whatever
     logger.setLevel(logging.INFO)
-    handler = logging.FileHandler('file.log', 'a', 'utf-8')  # or whatever
-    handler.setFormatter(
-        logging.Formatter(u"%(asctime)s : %(levelname)s - %(name)s - %(filename)s - %(message)s"))  # or whatever
-    logger.addHandler(handler)
+    logger.addHandler(queue_handler)
+
+    @classmethod
+    def start(cls):
+        if cls.pid == os.getpid():
+            return
+        with cls.start_lock:
+            if cls.pid == os.getpid():
+                return
+            if cls.pid is not None:
+                # forked: the thread stayed in the parent, its records too
+                cls.log_queue = queue.Queue(cls.queue_size)
+                cls.queue_handler.queue = cls.listener.queue = cls.log_queue
+            cls.listener.start()
+            cls.pid = os.getpid()
+
+    @classmethod
+    def stop(cls):
+        # write what is left in the queue and close the file
+        if cls.pid == os.getpid():
+            cls.logger.removeHandler(cls.queue_handler)
+            cls.listener.stop()
+            cls.handler.close()
+            cls.pid = None
+
+    @classmethod
+    def dropped(cls):
+        return cls.queue_handler.dropped
+
+
+MakeLog.queue_handler.start = MakeLog.start
+atexit.register(MakeLog.stop)
@@ -1,22 +1,49 @@
 import os
-import uuid
+import time
+
+import click
 
 from MakeLog import MakeLog
 # pip install flask
-from flask import Flask, render_template, flash, request, redirect, jsonify, url_for
+from flask import Flask, render_template, flash, request, redirect, jsonify, url_for, abort, stream_with_context
+from flask.cli import AppGroup
+from jinja2 import FileSystemBytecodeCache
 from datetime import datetime, date
 # pip install flask-sqlalchemy
 from flask_sqlalchemy import SQLAlchemy
 # pip install Flask-Migrate
 from flask_migrate import Migrate
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
 # pip install Flask-Login
 from flask_login import UserMixin, login_user, LoginManager, login_required, logout_user, current_user
 # import from self py file
 from webforms import NameForm, PasswordForm, UserForm, PostForm, LoginForm, SearchForm
 #  pip install flask-ckeditor
 from flask_ckeditor import CKEditor
+# full-text search for posts
+import search_index
+import db_engine
+from pagination import encode_cursor, keyset_page, keyset_query, split_page
+import query_counter
+from metrics import Metrics
+from page_cache import PageCache
+from user_cache import UserCache
+import images
+import assets
+import bulk
+import sanitize
+from passwords import PasswordPolicy, PasswordBusy
+from rate_limit import RateLimiter, RateLimited
+from async_db import AsyncDB
+import session_store
+import body_limits
+import json_api
+from json_api import ApiError
+from slugs import slugify, SlugCache
+import jobs
+from jobs import JobQueue
+# pip install sqlalchemy
+from sqlalchemy import bindparam, insert, inspect, select, or_
+from sqlalchemy.orm import defer, joinedload, validates
 
 
 HOME = os.path.expanduser("~")
@@ -28,10 +55,33 @@ m_log = MakeLog.logger
 app = Flask(__name__)
 # CKEditor
 ckeditor = CKEditor(app)
-
-# configure the SQLite database, relative to the app instance folder
-app.config["SQLALCHEMY_DATABASE_URI"] = 'sqlite:///' + os.path.join(BASE_DIR, 'flask.db')
+# hashed and precompressed static files after flask --app app assets-build
+static_assets = assets.Assets(app)
+
+# compiled templates are kept on disk and shared by workers and restarts,
+# empty TEMPLATE_CACHE_DIR turns it off
+# https://jinja.palletsprojects.com/en/3.1.x/api/#bytecode-cache
+app.config['TEMPLATE_CACHE_DIR'] = os.environ.get('TEMPLATE_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'jinja'))
+# compile all templates on start, not on the first hit in every worker
+# (with gunicorn --preload it is done once before fork)
+app.config['TEMPLATE_PRECOMPILE'] = os.environ.get('TEMPLATE_PRECOMPILE') == '1'
+if app.config['TEMPLATE_CACHE_DIR']:
+    os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+
+# configure the database, SQLite file next to app.py by default
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get('DATABASE_URL',
+                                                       'sqlite:///' + os.path.join(BASE_DIR, 'flask.db'))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# WAL, busy timeout and pool for many threads, see db_engine.py
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = db_engine.engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
+# read replicas for read only views
+app.config['SQLALCHEMY_BINDS'] = db_engine.replica_binds(
+    [url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url])
+app.config['SQLITE_PRAGMAS'] = db_engine.SQLITE_PRAGMAS
+db_engine.init_app(app)
+# async driver for async views, by default the same database (see async_db.py)
+app.config['ASYNC_DATABASE_URL'] = os.environ.get('ASYNC_DATABASE_URL')
 # secret key, used like token in wtf
 app.config['SECRET_KEY'] = "chang it in your project"
 # Environment and Debug Features
@@ -40,29 +90,133 @@ app.config['FLASK_ENV'] = 'development'
 # name main flask file
 app.config['FLASK_APP'] = 'app.py'
 
-# create the extension
-db = SQLAlchemy()
+# create the extension, session sends reads of @read_replica views to replicas
+db = SQLAlchemy(session_options={'class_': db_engine.RoutingSession})
 # initialize the app with the extension
 db.init_app(app)
 # for migrate
 migrate = Migrate(app, db, render_as_batch=True)
+# sessions of async views
+async_db = AsyncDB(app)
 
 # migration
 # migrate.init_app(app, db)
 
 UPLOAD_IMAGE='static/images/'
-app.config['UPLOAD_FOLDER'] = UPLOAD_IMAGE
+app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', os.path.join(BASE_DIR, UPLOAD_IMAGE))
+# max size of profile picture
+app.config['IMAGE_MAX_BYTES'] = 5 * 1024 * 1024
+# a picture nobody has is removed when it is older than this, seconds
+# (an upload of the same picture may be on disk before its commit)
+app.config['IMAGE_GRACE'] = 3600
+# request bodies, see body_limits.py: small for all views, pictures and
+# posts get more; text fields are held in memory, files over
+# UPLOAD_SPOOL_BYTES are written to a temp file while the body is read
+app.config['MAX_CONTENT_LENGTH'] = 256 * 1024
+app.config['MAX_FORM_MEMORY_SIZE'] = 256 * 1024
+# (werkzeug's multipart parser counts its 64 KB read buffer in form memory)
+app.config['BODY_LIMITS'] = {
+    'dashboard': (app.config['IMAGE_MAX_BYTES'] + 64 * 1024, 256 * 1024),
+    'update': (app.config['IMAGE_MAX_BYTES'] + 64 * 1024, 256 * 1024),
+    # CKEditor html
+    'add_post': (2 * 1024 * 1024, 2 * 1024 * 1024),
+    'edit_post': (2 * 1024 * 1024, 2 * 1024 * 1024),
+}
+app.config['UPLOAD_SPOOL_BYTES'] = 64 * 1024
+app.config['UPLOAD_SPOOL_DIR'] = None
+body_limits.init_app(app)
+# background jobs after commit (thumbnails, search index), see jobs.py
+app.config['JOBS_DB'] = os.environ.get('JOBS_DB', os.path.join(BASE_DIR, 'jobs.db'))
+# threads of every server process, 0 - jobs are run by flask --app app jobs work
+app.config['JOBS_WORKERS'] = int(os.environ.get('JOBS_WORKERS', 2))
+app.config['JOBS_TIMEOUT'] = 300
+job_queue = JobQueue(app, m_log)
+# password hashing: method with cost, threads for hashing and max waiting checks
+app.config['PASSWORD_METHOD'] = 'pbkdf2:sha256:600000'
+app.config['PASSWORD_WORKERS'] = 4
+app.config['PASSWORD_QUEUE'] = 32
+passwords = PasswordPolicy(app)
+# posts on one page of /posts
+app.config['POSTS_PER_PAGE'] = 10
+# items on one page of /api/posts, ?limit= up to API_MAX_LIMIT
+app.config['API_PER_PAGE'] = 50
+app.config['API_MAX_LIMIT'] = 1000
+# length of the post text shown in listings
+EXCERPT_LENGTH = 300
+# max sql queries per page, checked in debug and testing mode
+app.config['QUERY_BUDGETS'] = {
+    'posts': 3,
+    'post': 3,
+    'search': 4,
+}
+query_counter.init_app(app, m_log)
+# request timings on /metrics for the admin and a scraper with this token
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+# Server-Timing header in responses, SERVER_TIMING=1 in development
+app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING') == '1'
+metrics = Metrics(app)
+# cache of rendered pages and fragments: 'filesystem' (all workers of the host),
+# 'memory' (one worker) or None
+app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'filesystem')
+app.config['CACHE_DIR'] = os.environ.get('CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'pages'))
+app.config['CACHE_TTL'] = 300
+# bytes, in memory or on disk
+app.config['CACHE_MAX_BYTES'] = 16 * 1024 * 1024
+page_cache = PageCache(app)
+# logged in users, seconds to keep
+app.config['USER_CACHE_TTL'] = 30
+user_cache = UserCache(app.config['USER_CACHE_TTL'])
+# slug -> post id for /posts/<slug>
+app.config['SLUG_CACHE_SIZE'] = 10000
+slug_cache = SlugCache(app.config['SLUG_CACHE_SIZE'])
+# requests per seconds for one ip or user: 'memory' or 'sqlite' (all workers) or None
+app.config['RATE_LIMIT_BACKEND'] = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+app.config['RATE_LIMIT_DB'] = os.path.join(BASE_DIR, 'cache', 'rate_limit.db')
+app.config['RATE_LIMITS'] = {
+    'login': (10, 60),
+    # the same account from many ips
+    'login_username': (20, 600),
+    'test_pw': (10, 60),
+    'search': (30, 60),
+    'upload': (10, 60),
+}
+rate_limiter = RateLimiter(app)
+# sessions on the server, cookie has only the id: 'sqlite', 'memory' (one worker)
+# or None for the flask signed cookie
+app.config['SESSION_BACKEND'] = os.environ.get('SESSION_BACKEND', 'sqlite')
+app.config['SESSION_DB'] = os.path.join(BASE_DIR, 'cache', 'sessions.db')
+app.config['SESSION_MAX_ENTRIES'] = 100000
+session_store.init_app(app)
+
+def render_content(content):
+    # clean html, plain text and excerpt of the post, made once on save
+    body_html, body_text = sanitize.clean(content)
+    excerpt = body_text
+    if len(excerpt) > EXCERPT_LENGTH:
+        excerpt = excerpt[:EXCERPT_LENGTH].rsplit(' ', 1)[0] + '...'
+    return {'body_html': body_html, 'body_text': body_text, 'excerpt': excerpt}
+
 
 # Create a Blog Post model
 class Posts(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    title = db.Column(db.String(255), nullable=False)
+    # search without fts orders by title
+    title = db.Column(db.String(255), nullable=False, index=True)
     content = db.Column(db.Text, nullable=False)
     # author = db.Column(db.String(255), nullable=False)
-    date_added = db.Column(db.DateTime, default=datetime.now())
-    slug = db.Column(db.String(255), nullable=False)
+    date_added = db.Column(db.DateTime, default=datetime.now)
+    # /posts/<slug>, old slugs are in post_slugs
+    slug = db.Column(db.String(255), nullable=False, unique=True, index=True)
+    # filled when content is set: sanitized html for the post page,
+    # plain text and short excerpt for listings
+    body_html = db.Column(db.Text)
+    body_text = db.Column(db.Text)
+    excerpt = db.Column(db.String(EXCERPT_LENGTH + 3))
     # foreigen key to link user (refer to primary key of the user)
-    poster_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    poster_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+
+    # index for keyset pagination of /posts
+    __table_args__ = (db.Index('ix_posts_date_added_id', 'date_added', 'id'),)
 
     def __init__(self, title, content, slug, poster_id):
         self.title = title
@@ -70,6 +224,19 @@ class Posts(db.Model):
         self.slug = slug
         self.poster_id = poster_id
 
+    @validates('content')
+    def render_content(self, key, content):
+        for name, value in render_content(content).items():
+            setattr(self, name, value)
+        return content
+
+
+# old slugs of posts, they redirect to the current one
+class PostSlug(db.Model):
+    __tablename__ = 'post_slugs'
+    slug = db.Column(db.String(255), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False, index=True)
+
 
 # Create Model
 class User(db.Model, UserMixin):
@@ -79,10 +246,14 @@ class User(db.Model, UserMixin):
     email = db.Column(db.String(100), nullable=False, unique=True)
     favorite_color = db.Column(db.String(100))
     about_author = db.Column(db.Text(500))
-    date_added = db.Column(db.DateTime, default=datetime.now())
-    profile_pic = db.Column(db.String())
+    # list of users is ordered by date
+    date_added = db.Column(db.DateTime, default=datetime.now, index=True)
+    # old picture is removed when nobody else has it
+    profile_pic = db.Column(db.String(), index=True)
+    # thumbnails of profile_pic are made
+    profile_pic_ready = db.Column(db.Boolean, default=False)
     # DO SOME user stuff
-    password_hash = db.Column(db.String(100), nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)
     # User can have many posts
     posts = db.relationship('Posts', backref='poster')
 
@@ -92,10 +263,10 @@ class User(db.Model, UserMixin):
 
     @password.setter
     def password(self, p):
-        self.password_hash = generate_password_hash(p)
+        self.password_hash = passwords.hash(p)
 
     def verify_password(self, p):
-        return check_password_hash(self.password_hash, p)
+        return passwords.verify(self.password_hash, p)
 
     def __init__(self, username, name, email, favorite_color, about_author, password_hash, profile_pic):
         self.username = username
@@ -106,14 +277,346 @@ class User(db.Model, UserMixin):
         self.password_hash = password_hash
         self.profile_pic = profile_pic
 
+    # what post pages show about the poster, cache is dropped when it changes
+    def poster_info(self):
+        return self.name, self.profile_pic, self.about_author
+
+    def avatar_url(self, size=150):
+        # thumbnail when it's ready, default picture until then
+        if self.profile_pic and self.profile_pic_ready:
+            return url_for('static', filename='images/' + images.thumb_name(self.profile_pic, size))
+        if self.profile_pic and images.Image is None:
+            return url_for('static', filename='images/' + self.profile_pic)
+        return url_for('static', filename='images/default_user.jpg')
+
     # Create a String
     def __repr__(self):
         return '<Name %r>' % self.name
 
 
-# db create
-with app.app_context():
+# keep full-text index in sync with posts, a job indexes the post after commit
+def index_later(session, post_id):
+    job_queue.after_commit(session, 'search-index', post_id, key=f'search-index:{post_id}')
+
+
+search_index.listen(Posts, defer=index_later)
+
+
+@job_queue.task('search-index')
+def update_search_index(post_id):
+    search_index.update_post(db.session, Posts, post_id)
+    db.session.commit()
+
+
+def add_missing_columns(conn):
+    # create_all doesn't change existing tables: columns added to the models
+    # later (body_html, excerpt, profile_pic_ready...) are added here, strings
+    # made longer (password_hash) are widened; return added 'table.column'
+    preparer = conn.dialect.identifier_preparer
+    added = []
+    for table in db.metadata.sorted_tables:
+        existing = {c['name']: c['type'] for c in inspect(conn).get_columns(table.name)}
+        alter = f'ALTER TABLE {preparer.format_table(table)} '
+        for column in table.columns:
+            sql_type = column.type.compile(conn.dialect)
+            if column.name not in existing:
+                conn.exec_driver_sql(alter + f'ADD COLUMN {preparer.format_column(column)} {sql_type}')
+                added.append(f'{table.name}.{column.name}')
+                continue
+            # sqlite doesn't check the length of strings; postgres syntax
+            length = getattr(column.type, 'length', None)
+            old_length = getattr(existing[column.name], 'length', None)
+            if conn.dialect.name != 'sqlite' and length and old_length and old_length < length:
+                conn.exec_driver_sql(alter + f'ALTER COLUMN {preparer.format_column(column)} TYPE {sql_type}')
+    return added
+
+
+def normalize_slugs(conn):
+    # slugs of the old form were free text and not unique ("1", "my/post"):
+    # the first post with a valid slug keeps it, the others get a slugified
+    # free one and their old slug goes to post_slugs, so old links redirect
+    rows = conn.execute(select(Posts.id, Posts.slug).order_by(Posts.id)).all()
+    taken = set()
+    kept = set()
+    for id, slug in rows:
+        if slugify(slug) == slug and slug not in taken:
+            taken.add(slug)
+            kept.add(id)
+    changed = []
+    for id, slug in rows:
+        if id in kept:
+            continue
+        new = unique_slug(slugify(slug), taken=taken)
+        taken.add(new)
+        if new != slug:
+            changed.append((id, slug, new))
+    if not changed:
+        return []
+    posts_table = Posts.__table__
+    conn.execute(posts_table.update().where(posts_table.c.id == bindparam('post_id'))
+                 .values(slug=bindparam('new_slug')),
+                 [{'post_id': id, 'new_slug': new} for id, old, new in changed])
+    # a duplicate's old slug is the slug of the first post, it stays there
+    history = [{'slug': old, 'post_id': id} for id, old, new in changed if old not in taken]
+    for part in bulk.chunks(history, 500):
+        conn.execute(PostSlug.__table__.delete().where(PostSlug.slug.in_([h['slug'] for h in part])))
+        conn.execute(insert(PostSlug), part)
+    return [id for id, old, new in changed]
+
+
+def create_db():
     db.create_all()
+    with db.engine.begin() as conn:
+        added = add_missing_columns(conn)
+        changed = normalize_slugs(conn)
+        # create_all doesn't add new indexes to existing tables,
+        # an index that became unique is made again
+        for table in db.metadata.sorted_tables:
+            existing = {ix['name']: bool(ix['unique']) for ix in inspect(conn).get_indexes(table.name)}
+            for index in table.indexes:
+                if existing.get(index.name, index.unique) != bool(index.unique):
+                    index.drop(conn)
+                index.create(conn, checkfirst=True)
+        search_index.create_index(conn)
+    # the sqlite files next to the db: jobs, sessions, rate limits
+    job_queue.create_tables()
+    session_store.create_tables(app)
+    rate_limiter.create_tables()
+    if added:
+        m_log.info(f'columns added: {", ".join(added)}')
+    if 'posts.body_html' in added:
+        backfill_posts()
+    if 'user.profile_pic_ready' in added:
+        queue_thumbnails()
+    if changed:
+        m_log.info(f'slugs of {len(changed)} posts changed')
+        page_cache.bump('posts', *(f'post:{id}' for id in changed))
+
+
+def slugs_taken(slug, post_id=None):
+    # the slug and slug-2, slug-3... in one range lookup of the unique index
+    query = select(Posts.slug).where(or_(Posts.slug == slug,
+                                         Posts.slug.between(slug + '-', slug + '-\uffff')))
+    if post_id is not None:
+        query = query.where(Posts.id != post_id)
+    return set(db.session.scalars(query))
+
+
+def unique_slug(slug, post_id=None, taken=None):
+    if taken is None:
+        taken = slugs_taken(slug, post_id)
+    candidate, n = slug, 2
+    while candidate in taken:
+        candidate, n = f'{slug}-{n}', n + 1
+    return candidate
+
+
+# tables, indexes and search index, jobs / sessions / rate limit tables,
+# on deploy instead of on every import
+# flask --app app init-db
+@app.cli.command('init-db')
+def init_db():
+    create_db()
+    print('database is ready')
+
+
+def precompile_templates():
+    # load every template into the jinja cache, return their count
+    names = app.jinja_env.list_templates(filter_func=lambda name: name.endswith('.html'))
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+# fill the bytecode cache before the app is started, e.g. in a deploy step
+# flask --app app templates-compile
+@app.cli.command('templates-compile')
+def templates_compile():
+    print(f'compiled {precompile_templates()} templates')
+
+
+# rebuild search index for existing database
+# flask --app app search-rebuild
+@app.cli.command('search-rebuild')
+def search_rebuild():
+    with db.engine.begin() as conn:
+        if not search_index.create_index(conn):
+            print('full-text index needs sqlite with FTS5, search uses LIKE')
+            return
+        count = search_index.rebuild(conn)
+    print(f'indexed {count} posts')
+
+
+# listings show only excerpt, the bodies stay in db; poster is loaded
+# in the same query, no select per post
+LISTING_OPTIONS = [defer(Posts.content), defer(Posts.body_html), defer(Posts.body_text),
+                   joinedload(Posts.poster)]
+
+
+def backfill_posts(chunk=500, all_posts=False):
+    # fill body_html, body_text and excerpt of posts saved before these columns
+    progress = bulk.Progress('posts')
+    last_id = 0
+    while True:
+        query = select(Posts.id, Posts.content).where(Posts.id > last_id)
+        if not all_posts:
+            query = query.where(Posts.body_html.is_(None))
+        rows = db.session.execute(query.order_by(Posts.id).limit(chunk)).all()
+        if not rows:
+            break
+        db.session.bulk_update_mappings(Posts, [{'id': id, **render_content(content)} for id, content in rows])
+        db.session.commit()
+        last_id = rows[-1].id
+        progress.add(len(rows))
+    progress.report()
+    page_cache.bump('posts')
+
+
+# init-db does it when it adds the columns
+# flask --app app posts-backfill
+@app.cli.command('posts-backfill')
+@click.option('--chunk', default=500, help='posts in one transaction')
+@click.option('--all', 'all_posts', is_flag=True, help='render all posts again, not only empty')
+def posts_backfill(chunk, all_posts):
+    backfill_posts(chunk, all_posts)
+
+
+# Bulk import / export of posts and users, jsonl or csv
+# flask --app app import-users users.jsonl --password secret
+# flask --app app import-posts posts.csv --chunk 5000
+# flask --app app export-posts posts.jsonl
+POST_FIELDS = ['id', 'title', 'content', 'slug', 'date_added', 'poster_id']
+USER_FIELDS = ['id', 'username', 'name', 'email', 'favorite_color', 'about_author',
+               'date_added', 'profile_pic', 'password_hash']
+
+
+def insert_chunk(model, values):
+    # rows with id and without it are inserted apart, return new ids in order of values
+    ids = [None] * len(values)
+    for with_id in (True, False):
+        part = [i for i, v in enumerate(values) if (v.get('id') is not None) == with_id]
+        if not part:
+            continue
+        rows = [values[i] if with_id else {k: v for k, v in values[i].items() if k != 'id'} for i in part]
+        result = db.session.execute(insert(model).returning(model.id, sort_by_parameter_order=True), rows)
+        for i, id in zip(part, result.scalars()):
+            ids[i] = id
+    return ids
+
+
+def file_format(path):
+    try:
+        return bulk.file_format(path)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def import_rows(path, name, model, chunk, make_values, after_insert=None, before_insert=None):
+    fmt = file_format(path)
+    progress = bulk.Progress(name)
+    done = 0
+    with bulk.open_file(path) as f:
+        for rows in bulk.chunks(bulk.read_rows(f, fmt), chunk):
+            values = []
+            for n, row in enumerate(rows, done + 1):
+                try:
+                    values.append(make_values(row))
+                except (KeyError, TypeError, ValueError) as e:
+                    # the chunks before it are committed
+                    raise click.ClickException(f'{name} row {n}: {type(e).__name__} {e}, '
+                                               f'{done} rows imported before it')
+            done += len(rows)
+            if before_insert:
+                before_insert(values)
+            ids = insert_chunk(model, values)
+            if after_insert:
+                after_insert(ids, values)
+            # one transaction per chunk
+            db.session.commit()
+            progress.add(len(rows))
+    progress.report()
+
+
+def export_rows(path, name, model, fields, chunk):
+    fmt = file_format(path)
+    progress = bulk.Progress(name)
+    columns = [getattr(model, field) for field in fields]
+    rows = db.session.execute(select(*columns).order_by(model.id).execution_options(yield_per=chunk))
+    with bulk.open_file(path, 'w') as f:
+        bulk.write_rows(f, fmt, fields, rows, progress)
+    progress.report()
+
+
+def post_values(row):
+    return {'id': row.get('id'),
+            'title': row['title'],
+            'content': row['content'],
+            **render_content(row['content']),
+            # csv has None for an empty cell, jsonl may leave the key out
+            'slug': slugify(row.get('slug') or row['title']),
+            'date_added': bulk.parse_date(row.get('date_added')),
+            'poster_id': row.get('poster_id')}
+
+
+def unique_slugs(values):
+    # one query for the chunk, only rows with a taken slug look for a free one
+    taken = set(db.session.scalars(select(Posts.slug).where(Posts.slug.in_({v['slug'] for v in values}))))
+    seen = set()
+    for v in values:
+        if v['slug'] in taken or v['slug'] in seen:
+            v['slug'] = unique_slug(v['slug'], taken=slugs_taken(v['slug']) | seen)
+        seen.add(v['slug'])
+
+
+@app.cli.command('import-posts')
+@click.argument('path')
+@click.option('--chunk', default=1000, help='rows in one transaction')
+def import_posts(path, chunk):
+    def index(ids, values):
+        # bulk insert doesn't run mapper events, search index is filled here
+        search_index.index_new_posts(db.session.connection(),
+                                     [(id, v['title'], v['content']) for id, v in zip(ids, values)])
+    import_rows(path, 'posts', Posts, chunk, post_values, index, unique_slugs)
+    page_cache.bump('posts')
+
+
+@app.cli.command('import-users')
+@click.argument('path')
+@click.option('--chunk', default=1000, help='rows in one transaction')
+@click.option('--password', help='password for rows without password_hash')
+def import_users(path, chunk, password):
+    # one hash for all users without password_hash, hashing every row is too slow
+    default_hash = passwords.hash(password) if password else None
+
+    def user_values(row):
+        password_hash = row.get('password_hash') or default_hash
+        if not password_hash:
+            raise click.ClickException(f"user {row['username']} has no password_hash, use --password")
+        return {'id': row.get('id'),
+                'username': row['username'],
+                'name': row['name'],
+                'email': row['email'],
+                'favorite_color': row.get('favorite_color'),
+                'about_author': row.get('about_author'),
+                'date_added': bulk.parse_date(row.get('date_added')),
+                'profile_pic': row.get('profile_pic'),
+                'profile_pic_ready': False,
+                'password_hash': password_hash}
+    import_rows(path, 'users', User, chunk, user_values)
+
+
+@app.cli.command('export-posts')
+@click.argument('path')
+@click.option('--chunk', default=1000, help='rows fetched at once')
+def export_posts(path, chunk):
+    export_rows(path, 'posts', Posts, POST_FIELDS, chunk)
+
+
+@app.cli.command('export-users')
+@click.argument('path')
+@click.option('--chunk', default=1000, help='rows fetched at once')
+def export_users(path, chunk):
+    export_rows(path, 'users', User, USER_FIELDS, chunk)
 
 
 # Bootstrap
@@ -130,6 +633,7 @@ with app.app_context():
 # striptags - удаляет html теги
 # title - все будут с большой буквы
 # trim - удаляет пробелы в начале и в конце строки
+@db_engine.read_replica
 def index():
     m_log.info("open /")
     first_name = "John"
@@ -144,6 +648,7 @@ def index():
 
 # localhost:5000/user/John
 @app.route('/user/<name>')
+@db_engine.read_replica
 def user(name):
     # https://jinja.palletsprojects.com/en/3.1.x/templates/#filters
     # https://jinja.palletsprojects.com/en/3.1.x/templates/#id11
@@ -169,6 +674,7 @@ def name():
 
 # create password test page
 @app.route('/test_pw', methods=["GET", "POST"])
+@rate_limiter.limit('test_pw')
 def test_pw():
     m_log.info("open /test_pw")
     email = None
@@ -187,7 +693,7 @@ def test_pw():
         pw_to_check = User.query.filter_by(email=email).first()
 
         # check hashed password
-        passed = check_password_hash(pw_to_check.password_hash, password)
+        passed = pw_to_check is not None and passwords.verify(pw_to_check.password_hash, password)
 
         # flash('Form Submit Successfully!')
     return render_template("test_pw.html",
@@ -207,13 +713,14 @@ def add_user():
     if form.validate_on_submit():
         if User.query.filter_by(email=form.email.data).first() is None:
             # hash password
-            hashed_PW = generate_password_hash(form.password_hash.data, "sha256")
+            hashed_PW = passwords.hash(form.password_hash.data)
             user = User(username=form.username.data,
                         name=form.name.data,
                         email=form.email.data,
                         favorite_color=form.favorite_color.data,
                         about_author=form.about_author.data,
-                        password_hash=hashed_PW)
+                        password_hash=hashed_PW,
+                        profile_pic=None)
             db.session.add(user)
             db.session.commit()
         name = form.name.data
@@ -234,24 +741,33 @@ def add_user():
 
 # Update DataBase Record
 @app.route("/update/<int:id>", methods=["GET", "POST"])
+@rate_limiter.limit('upload')
 def update(id):
     m_log.info(f"open /update/{id}")
     form = UserForm()
     user_to_update = User.query.get_or_404(id)
     if request.method == "POST":
+        poster_info = user_to_update.poster_info()
         user_to_update.name = request.form['name']
         user_to_update.email = request.form['email']
         user_to_update.favorite_color = request.form['favorite_color']
         user_to_update.about_author = request.form['about_author']
         user_to_update.username = request.form['username']
-        user_to_update.profile_pic = request.files['profile_pic']
-        # grab image name
-        pic_filemame = secure_filename(user_to_update.profile_pic.filename)
-        # set uuid
-        pic_name = f"{str(uuid.uuid1())}_{pic_filemame}"
-        user_to_update.profile_pic = pic_name
+        old_pic = user_to_update.profile_pic
+        try:
+            pic_name = save_profile_pic(user_to_update)
+        except images.UploadTooLarge:
+            flash('Image is too large!')
+            return render_template("update.html",
+                                   form=form,
+                                   user_to_update=user_to_update,
+                                   id=id)
         try:
             db.session.commit()
+            profile_pic_saved(id, pic_name, old_pic)
+            user_cache.invalidate(id)
+            if poster_info != user_to_update.poster_info():
+                page_cache.bump(f'user:{id}')
             flash('Form Update Successfully!')
             return render_template("update.html",
                                    form=form,
@@ -281,6 +797,9 @@ def delete(id):
         try:
             db.session.delete(user_to_delete)
             db.session.commit()
+            user_cache.invalidate(id)
+            # posts of the user are left without poster
+            page_cache.bump(f'user:{id}', 'posts')
 
             our_users = User.query.order_by(User.date_added)
             flash('Form Delete Successfully!')
@@ -300,17 +819,76 @@ def delete(id):
         return redirect(url_for('dashboard'))
 
 @app.route('/posts')
+@page_cache.cached_page('posts', args=['after'])
+@db_engine.read_replica
 def posts():
     m_log.info(f"open /posts")
-    # Grab all posts from database
-    posts = Posts.query.order_by(Posts.date_added)
-    return render_template("posts.html", posts=posts)
+    # Grab one page of posts, full content is loaded only on post page
+    # poster is loaded in the same query, no select per post
+    posts, next_cursor = keyset_page(Posts.query.options(*LISTING_OPTIONS),
+                                     Posts.date_added, Posts.id,
+                                     cursor=request.args.get('after'),
+                                     per_page=app.config['POSTS_PER_PAGE'])
+    return render_template("posts.html", posts=posts, next_cursor=next_cursor)
 
 
 @app.route("/posts/<int:id>", methods=["GET", "POST"])
+@page_cache.cached_page('post:{id}')
+@db_engine.read_replica
 def post(id):
     m_log.info(f"open /post")
-    post = Posts.query.get_or_404(id)
+    post = Posts.query.options(joinedload(Posts.poster)).get_or_404(id)
+    page_cache.add_tags(f'user:{post.poster_id}')
+    return render_template("post.html", post=post)
+
+
+# the same page by slug, the slug cache answers without sql, so it is
+# one query by primary key too; old slugs redirect to the current one
+@app.route("/posts/<slug>")
+@page_cache.cached_page()
+@db_engine.read_replica
+def post_by_slug(slug):
+    m_log.info(f"open /post")
+    id = slug_cache.get(slug)
+    post = db.session.get(Posts, id, options=[joinedload(Posts.poster)]) if id else None
+    if post is None or post.slug != slug:
+        # changed or deleted in another worker
+        if id:
+            slug_cache.invalidate(slug)
+        id = db.session.scalar(select(Posts.id).where(Posts.slug == slug))
+        if id is None:
+            old = db.session.get(PostSlug, slug)
+            if old is None:
+                abort(404)
+            current = db.session.scalar(select(Posts.slug).where(Posts.id == old.post_id))
+            return redirect(url_for('post_by_slug', slug=current), 301)
+        slug_cache.put(slug, id)
+        post = db.session.get(Posts, id, options=[joinedload(Posts.poster)])
+    page_cache.add_tags(f'post:{post.id}', f'user:{post.poster_id}')
+    return render_template("post.html", post=post)
+
+
+# async variants of the read views for an ASGI server (see asgi.py),
+# page cache and replicas are not used here, their decorators are sync
+@app.route('/async/posts')
+async def posts_async():
+    m_log.info("open /async/posts")
+    async with async_db.session() as session:
+        query = keyset_query(select(Posts).options(*LISTING_OPTIONS), Posts.date_added, Posts.id,
+                             cursor=request.args.get('after'),
+                             per_page=app.config['POSTS_PER_PAGE'])
+        items = (await session.scalars(query)).unique().all()
+    posts, next_cursor = split_page(items, Posts.date_added, Posts.id, app.config['POSTS_PER_PAGE'])
+    return render_template("posts.html", posts=posts, next_cursor=next_cursor)
+
+
+@app.route('/async/posts/<int:id>')
+async def post_async(id):
+    m_log.info("open /async/post")
+    async with async_db.session() as session:
+        post = await session.get(Posts, id, options=[joinedload(Posts.poster)])
+    if post is None:
+        abort(404)
     return render_template("post.html", post=post)
 
 
@@ -324,13 +902,21 @@ def edit_post(id):
         post.title = form.title.data
         post.content = form.content.data
         # post.author = form.author.data
-        post.slug = form.slug.data
+        old_slug = post.slug
+        slug = slugify(form.slug.data)
+        if slug != old_slug:
+            post.slug = unique_slug(slug, post.id)
+            # the old url redirects here, the new one is not an old slug anymore
+            PostSlug.query.filter_by(slug=post.slug).delete()
+            db.session.add(PostSlug(slug=old_slug, post_id=post.id))
         # Update DB
         db.session.add(post)
         db.session.commit()
+        slug_cache.invalidate(old_slug)
+        page_cache.bump('posts', f'post:{id}')
         flash("Post Has Been Update!")
-        return redirect(url_for('post', id=post.id))
-    if current_user.id == post.poster.id:
+        return redirect(url_for('post_by_slug', slug=post.slug))
+    if current_user.id == post.poster_id:
         form.title.data = post.title
         form.content.data = post.content
         # form.author.data = post.author
@@ -338,8 +924,7 @@ def edit_post(id):
         return render_template('edit_post.html', form=form)
     else:
         flash('You aren\'t authorized to edit thet post')
-        posts = Posts.query.order_by(Posts.date_added)
-        return render_template("posts.html", posts=posts)
+        return redirect(url_for('posts'))
 
 
 @app.route("/posts/delete/<int:id>", methods=["GET", "POST"])
@@ -348,23 +933,23 @@ def delete_post(id):
     m_log.info(f"open /delete_post")
     post_to_delete = Posts.query.get_or_404(id)
     cid = current_user.id
-    if cid == post_to_delete.poster.id:
+    if cid == post_to_delete.poster_id:
         try:
+            PostSlug.query.filter_by(post_id=id).delete()
             db.session.delete(post_to_delete)
             db.session.commit()
+            slug_cache.invalidate(post_to_delete.slug)
+            page_cache.bump('posts', f'post:{id}')
 
             flash('Post Was Delete Successfully!')
-            posts = Posts.query.order_by(Posts.date_added)
-            return render_template("posts.html", posts=posts)
+            return redirect(url_for('posts'))
 
         except:
             flash('Post Delete Error!')
-            posts = Posts.query.order_by(Posts.date_added)
-            return render_template("posts.html", posts=posts)
+            return redirect(url_for('posts'))
     else:
         flash('You aren\'t authorized to delete thet post')
-        posts = Posts.query.order_by(Posts.date_added)
-        return render_template("posts.html", posts=posts)
+        return redirect(url_for('posts'))
 
 
 # Add Posts Page
@@ -379,7 +964,7 @@ def add_post():
         post = Posts(title=form.title.data,
                      content=form.content.data,
                      poster_id=poster,
-                     slug=form.slug.data)
+                     slug=unique_slug(slugify(form.slug.data)))
         # clear the form
         form.title.data = ''
         form.content.data = ''
@@ -388,6 +973,7 @@ def add_post():
         # add post to db
         db.session.add(post)
         db.session.commit()
+        page_cache.bump('posts')
 
         flash("Blog Post submit success")
     # Redirect to the wevpage
@@ -402,20 +988,26 @@ login_manager.login_view = 'login'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.load(db.session, User, int(user_id))
 
 
 # create login page
 @app.route('/login', methods=['GET', 'POST'])
+@rate_limiter.limit('login')
 def login():
     m_log.info('/login')
     form = LoginForm()
     if form.validate_on_submit():
+        rate_limiter.check('login_username', form.username.data)
         user = User.query.filter_by(username=form.username.data).first()
         if user:
             # chech the hash
-            # if user.verify_password(form.password.data):
-            if check_password_hash(user.password_hash, form.password.data):
+            if user.verify_password(form.password.data):
+                # hash made with old method or cost
+                if passwords.needs_rehash(user.password_hash):
+                    user.password = form.password.data
+                    db.session.commit()
+                    user_cache.invalidate(user.id)
                 login_user(user)
                 flash('Login Succesfull')
                 return redirect(url_for('dashboard'))
@@ -437,42 +1029,209 @@ def logout():
     return redirect(url_for('login'))
 
 
+# profile pictures
+def save_profile_pic(user_to_update):
+    # copy uploaded picture to disk, return its name or None without upload
+    pic = request.files.get('profile_pic')
+    if not pic:
+        return None
+    pic_name = images.save_upload(pic, app.config['UPLOAD_FOLDER'], app.config['IMAGE_MAX_BYTES'])
+    user_to_update.profile_pic = pic_name
+    # the same picture may be uploaded before, with thumbnails
+    user_to_update.profile_pic_ready = images.thumbnails_exist(app.config['UPLOAD_FOLDER'], pic_name)
+    return pic_name
+
+
+def profile_pic_saved(user_id, pic_name, old_pic):
+    # after commit, thumbnails are made and the old picture is removed in jobs
+    if not pic_name or pic_name == old_pic:
+        return
+    if old_pic:
+        job_queue.enqueue('remove-picture', old_pic, key=f'remove-picture:{old_pic}',
+                          delay=app.config['IMAGE_GRACE'])
+    if images.Image is not None and not images.thumbnails_exist(app.config['UPLOAD_FOLDER'], pic_name):
+        job_queue.enqueue('thumbnails', user_id, pic_name, key=f'thumbnails:{user_id}')
+
+
+@job_queue.task('remove-picture')
+def remove_picture(pic_name):
+    # only when no user has it and nobody uploaded it again meanwhile,
+    # images-gc takes it later then
+    if (User.query.filter_by(profile_pic=pic_name).count() == 0
+            and not images.recently_saved(app.config['UPLOAD_FOLDER'], pic_name, app.config['IMAGE_GRACE'])):
+        images.remove_picture(app.config['UPLOAD_FOLDER'], pic_name)
+
+
+def queue_thumbnails():
+    # pictures uploaded before profile_pic_ready: thumbnails in jobs, the
+    # default picture until then (the picture itself without Pillow)
+    if images.Image is None:
+        return
+    users = db.session.execute(select(User.id, User.profile_pic)
+                               .where(User.profile_pic.isnot(None), User.profile_pic != '')).all()
+    for user_id, pic_name in users:
+        job_queue.enqueue('thumbnails', user_id, pic_name, key=f'thumbnails:{user_id}')
+
+
+@job_queue.task('thumbnails')
+def make_thumbnails(user_id, pic_name):
+    if not images.thumbnails_exist(app.config['UPLOAD_FOLDER'], pic_name):
+        images.make_thumbnails(app.config['UPLOAD_FOLDER'], pic_name)
+    user = db.session.get(User, user_id)
+    # user may have uploaded another picture in the meantime
+    if user is None or user.profile_pic != pic_name:
+        return
+    user.profile_pic_ready = True
+    db.session.commit()
+    user_cache.invalidate(user_id)
+    page_cache.bump(f'user:{user_id}')
+
+
+# make thumbnails of pictures uploaded before
+# flask --app app images-rebuild
+@app.cli.command('images-rebuild')
+def images_rebuild():
+    users = User.query.filter(User.profile_pic.isnot(None), User.profile_pic != '').all()
+    for user in users:
+        try:
+            images.make_thumbnails(app.config['UPLOAD_FOLDER'], user.profile_pic)
+        except OSError as e:
+            print(f'{user.profile_pic}: {e}')
+            continue
+        user.profile_pic_ready = True
+    db.session.commit()
+    print(f'made thumbnails for {len(users)} users')
+
+
+# remove pictures which no user has
+# flask --app app images-gc
+@app.cli.command('images-gc')
+@click.option('--grace', default=app.config['IMAGE_GRACE'], help='keep files younger than this, seconds')
+def images_gc(grace):
+    referenced = {name for name, in db.session.query(User.profile_pic).distinct() if name}
+    removed, freed = images.collect_garbage(app.config['UPLOAD_FOLDER'], referenced, grace)
+    print(f'removed {removed} pictures, {freed} bytes')
+
+
+# background jobs
+# flask --app app jobs status
+# flask --app app jobs list --state failed
+# flask --app app jobs drain            run the ready jobs and exit
+# flask --app app jobs work             worker process (with JOBS_WORKERS=0 in the server)
+# flask --app app jobs retry [ID ...]   failed jobs once more
+# flask --app app jobs purge --state failed --older 604800
+jobs_cli = AppGroup('jobs', help='Background job queue.')
+app.cli.add_command(jobs_cli)
+
+
+@jobs_cli.command('status')
+def jobs_status():
+    for state, count in job_queue.counts().items():
+        print(f'{state:<8} {count}')
+
+
+@jobs_cli.command('list')
+@click.option('--state', type=click.Choice(jobs.STATES))
+@click.option('--limit', default=20)
+def jobs_list(state, limit):
+    for job in job_queue.recent(state, limit):
+        error = job.error.strip().splitlines()[-1] if job.error else ''
+        print(f'{job.id:>6} {job.state:<8} {job.attempts}/{job.max_attempts} {job.name} {job.args} {error}')
+
+
+@jobs_cli.command('drain')
+def jobs_drain():
+    print(f'{job_queue.drain()} jobs done')
+
+
+@jobs_cli.command('work')
+@click.option('--workers', default=2)
+def jobs_work(workers):
+    job_queue.start(workers)
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        print('stopping, waiting for running jobs')
+        job_queue.stop()
+
+
+@jobs_cli.command('retry')
+@click.argument('ids', nargs=-1, type=int)
+def jobs_retry(ids):
+    print(f'{job_queue.retry(ids)} jobs queued again')
+
+
+@jobs_cli.command('purge')
+@click.option('--state', type=click.Choice([jobs.DONE, jobs.FAILED]), default=jobs.DONE)
+@click.option('--older', default=0, help='seconds since the job finished')
+def jobs_purge(state, older):
+    print(f'{job_queue.purge(state, older)} jobs removed')
+
+
+# hash the static files, make .gz / .br and the manifest for url_for
+# flask --app app assets-build
+@app.cli.command('assets-build')
+def assets_build():
+    manifest = assets.build(app.static_folder)
+    static_assets.load()
+    print(f'{len(manifest)} static files in {assets.DIST_DIR}/')
+
+
+# pictures in the store, thumbnails and hashed static files never change,
+# browser may keep them forever
+IMMUTABLE_STATIC = ('images/' + images.STORE_DIR + '/', 'images/' + images.THUMB_DIR + '/', assets.DIST_DIR + '/')
+
+
+@app.after_request
+def cache_immutable_static(response):
+    if (request.endpoint == 'static' and response.status_code == 200
+            and request.view_args.get('filename', '').startswith(IMMUTABLE_STATIC)):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    return response
+
+
 # create dashboard page
 @app.route('/dashboard', methods=['GET', 'POST'])
 @login_required
+@rate_limiter.limit('upload')
 def dashboard():
     m_log.info('/dashboard')
     form = UserForm()
     id = current_user.id
     user_to_update = User.query.get_or_404(id)
     if request.method == "POST":
+        poster_info = user_to_update.poster_info()
         user_to_update.name = request.form['name']
         user_to_update.email = request.form['email']
         user_to_update.favorite_color = request.form['favorite_color']
         user_to_update.about_author = request.form['about_author']
         user_to_update.username = request.form['username']
-        # user_to_update.profile_pic = request.files['profile_pic']
-        if request.files['profile_pic']:
-            # grab image name
-            pic_filemame = secure_filename(request.files['profile_pic'].filename)
-            # pic_filemame = secure_filename(user_to_update.profile_pic.filename)
-            # set uuid
-            pic_name = f"{str(uuid.uuid1())}_{pic_filemame}"
+        old_pic = user_to_update.profile_pic
+        try:
+            # save image
+            pic_name = save_profile_pic(user_to_update)
             m_log.info(pic_name)
-            try:
-                # save image
-                saver = request.files['profile_pic']
-                saver.save(os.path.join(app.config['UPLOAD_FOLDER'], pic_name))
-            except:
-                flash('Image Update Error!')
-                return render_template("dashboard.html",
-                                       form=form,
-                                       user_to_update=user_to_update)
-
-
-            user_to_update.profile_pic = pic_name
+        except images.UploadTooLarge:
+            flash('Image is too large!')
+            return render_template("dashboard.html",
+                                   form=form,
+                                   user_to_update=user_to_update)
+        except:
+            flash('Image Update Error!')
+            return render_template("dashboard.html",
+                                   form=form,
+                                   user_to_update=user_to_update)
+
         try:
             db.session.commit()
+            profile_pic_saved(id, pic_name, old_pic)
+            user_cache.invalidate(id)
+            if poster_info != user_to_update.poster_info():
+                page_cache.bump(f'user:{id}')
             flash('Form Update Successfully!')
             return render_template("dashboard.html",
                                    form=form,
@@ -498,6 +1257,34 @@ def page_not_found(e):
     return render_template("error_404.html"), 404
 
 
+# Request body over the limit of the view
+@app.errorhandler(413)
+def too_large(e):
+    m_log.warning(f'{request.endpoint}: body of {request.content_length} bytes is too large')
+    return render_template("error_413.html"), 413
+
+
+# Too many logins at once, hashing pool is full
+@app.errorhandler(PasswordBusy)
+def password_busy(e):
+    m_log.warning(str(e))
+    return render_template("error_503.html"), 503, {'Retry-After': '5'}
+
+
+# Too many requests from one client
+@app.errorhandler(RateLimited)
+def rate_limited(e):
+    m_log.warning(str(e))
+    return render_template("error_429.html"), 429, {'Retry-After': str(e.retry_after)}
+
+
+# Bad request to the JSON API
+@app.errorhandler(ApiError)
+def api_error(e):
+    return api_headers(app.response_class(json_api.dumps({'error': str(e)}), e.status,
+                                          mimetype='application/json'))
+
+
 # Internal Server Error
 @app.errorhandler(500)
 def server_die(e):
@@ -516,29 +1303,124 @@ def get_current_date():
     # return {"Date": date.today()}
 
 
+# JSON read API, see json_api.py
+# /api/posts?fields=id,title&limit=100&after=<next>
+# /api/posts/<id>?fields=title,body_html
+# /api/users/<id>
+API_POST_COLUMNS = {'id': Posts.id, 'title': Posts.title, 'slug': Posts.slug, 'date_added': Posts.date_added,
+                    'excerpt': Posts.excerpt, 'poster_id': Posts.poster_id,
+                    'body_html': Posts.body_html, 'body_text': Posts.body_text}
+# fields of a list without ?fields=, the bodies only when asked
+API_POST_LIST_FIELDS = ['id', 'title', 'slug', 'date_added', 'excerpt', 'poster_id']
+# no email and password hash
+API_USER_FIELDS = ['id', 'username', 'name', 'about_author', 'date_added', 'avatar_url']
+# rows fetched from the db at once while a list is written
+API_YIELD_PER = 100
+
+
+def api_headers(response):
+    response.headers['API-Version'] = json_api.API_VERSION
+    # client must revalidate, it gets 304 while the data is the same
+    response.cache_control.no_cache = True
+    return response
+
+
+def api_item(data):
+    response = api_headers(app.response_class(json_api.dumps(data), mimetype='application/json'))
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+@app.route('/api/posts')
+@db_engine.read_replica
+def api_posts():
+    fields = json_api.parse_fields(request.args.get('fields'), API_POST_COLUMNS, API_POST_LIST_FIELDS)
+    limit = json_api.parse_limit(request.args.get('limit'), app.config['API_PER_PAGE'],
+                                 app.config['API_MAX_LIMIT'])
+    # changes with any write to posts, the same page again is 304 without sql
+    # (only with a cache shared by all workers, see PageCache.etag)
+    etag = page_cache.etag(request.full_path, 'posts')
+    if etag and request.if_none_match.contains(etag):
+        response = api_headers(app.response_class(status=304))
+        response.set_etag(etag)
+        return response
+    query = keyset_query(select(Posts.date_added.label('cursor_date'), Posts.id.label('cursor_id'),
+                                *[API_POST_COLUMNS[field].label(field) for field in fields]),
+                         Posts.date_added, Posts.id, cursor=request.args.get('after'), per_page=limit)
+    rows = db.session.execute(query.execution_options(yield_per=API_YIELD_PER))
+    body = json_api.stream_list('posts', rows, fields, limit,
+                                lambda row: encode_cursor(row.cursor_date, row.cursor_id),
+                                batch=API_YIELD_PER)
+    response = api_headers(app.response_class(stream_with_context(body), mimetype='application/json'))
+    if etag:
+        response.set_etag(etag)
+    return response
+
+
+@app.route('/api/posts/<int:id>')
+@db_engine.read_replica
+def api_post(id):
+    fields = json_api.parse_fields(request.args.get('fields'), API_POST_COLUMNS, API_POST_COLUMNS)
+    row = db.session.execute(select(*[API_POST_COLUMNS[field].label(field) for field in fields])
+                             .where(Posts.id == id)).first()
+    if row is None:
+        raise ApiError(404, 'post not found')
+    return api_item(dict(row._mapping))
+
+
+@app.route('/api/users/<int:id>')
+@db_engine.read_replica
+def api_user(id):
+    fields = json_api.parse_fields(request.args.get('fields'), API_USER_FIELDS, API_USER_FIELDS)
+    user = db.session.get(User, id)
+    if user is None:
+        raise ApiError(404, 'user not found')
+    values = {'id': user.id, 'username': user.username, 'name': user.name, 'about_author': user.about_author,
+              'date_added': user.date_added, 'avatar_url': user.avatar_url()}
+    return api_item({field: values[field] for field in fields})
+
+
 # pass stuf to navbar
 @app.context_processor
 def base():
-    form = SearchForm()
+    # empty navbar form, the body of a refused request is never parsed
+    form = SearchForm(formdata=None)
     return dict(form=form)
 
 # search function
 @app.route('/search', methods=["POST"])
+@db_engine.read_replica
+@rate_limiter.limit('search')
 def search():
     form = SearchForm()
-    posts = Posts.query
     if form.validate_on_submit():
         # get data from submit
-        post.searched = form.searched.data
-        m_log.info(f"open /search {post.searched}")
-        # query the db
-        posts = posts.filter(Posts.content.like('%' + post.searched + '%'))
-        posts = posts.order_by(Posts.title).all()
+        searched = form.searched.data
+        m_log.info(f"open /search {searched}")
+        # query the full-text index
+        results = search_index.search(db.session, Posts, searched, options=LISTING_OPTIONS)
 
         return render_template("search.html",
                                form=form,
-                               searched=post.searched,
-                               posts=posts)
+                               searched=searched,
+                               results=results)
+    return redirect(url_for('posts'))
+
+
+@app.route('/async/search', methods=["POST"])
+async def search_async():
+    rate_limiter.check('search', rate_limiter.client_key())
+    form = SearchForm()
+    if not form.validate_on_submit():
+        return redirect(url_for('posts'))
+    searched = form.searched.data
+    m_log.info(f"open /async/search {searched}")
+    async with async_db.session() as session:
+        results = await session.run_sync(search_index.search, Posts, searched, options=LISTING_OPTIONS)
+    return render_template("search.html",
+                           form=form,
+                           searched=searched,
+                           results=results)
 
 # admin page
 @app.route('/admin')
@@ -547,13 +1429,21 @@ def admin():
     m_log.info("open /admin")
     id = current_user.id
     if id == 1:
-        return render_template("admin.html")
+        return render_template("admin.html", user_cache=user_cache.stats(),
+                               slug_cache=slug_cache.stats())
     else:
         flash("Sorry, you mast be admin")
         return redirect(url_for('dashboard'))
 
+if app.config['TEMPLATE_PRECOMPILE']:
+    precompile_templates()
+
+
 if __name__ == '__main__':
     m_log.info("start server")
+    # dev server makes the db itself, in production run init-db
+    with app.app_context():
+        create_db()
     # app.run(host='0.0.0.0', port="5000", ssl_context='adhoc', threaded=True, debug=True)
     app.run(debug=True)
     m_log.info("stop server")
@@ -0,0 +1,63 @@
+# ASGI entry point for production
+# pip install "flask[async]" aiosqlite uvicorn
+# uvicorn asgi:application --host 0.0.0.0 --port 8000 --workers 4
+#
+# the flask app is wsgi, the adapter runs each request in a thread pool, so
+# a slow sqlite query, file write or upload doesn't stop the event loop;
+# /async/... views await the database with the async session (async_db.py)
+# run `flask --app app init-db` once before the first start
+from tempfile import SpooledTemporaryFile
+
+from asgiref.wsgi import WsgiToAsgi
+
+import body_limits
+from app import app
+
+wsgi_application = WsgiToAsgi(app)
+CHUNK = 64 * 1024
+
+
+async def too_large(send):
+    await send({'type': 'http.response.start', 'status': 413,
+                'headers': [(b'content-type', b'text/plain'), (b'connection', b'close')]})
+    await send({'type': 'http.response.body', 'body': b'Request Entity Too Large'})
+
+
+async def application(scope, receive, send):
+    # the adapter reads the whole body before the app runs (to a temp file
+    # over 64 KB), a body over the limit of the view is refused before that
+    if scope['type'] != 'http':
+        return await wsgi_application(scope, receive, send)
+    headers = dict(scope['headers'])
+    limit = body_limits.limit_of_path(app, scope['method'], scope['path'])
+    length = headers.get(b'content-length')
+    if limit is None or (length is None and b'transfer-encoding' not in headers):
+        return await wsgi_application(scope, receive, send)
+    if length is not None:
+        if length.isdigit() and int(length) > limit:
+            return await too_large(send)
+        return await wsgi_application(scope, receive, send)
+
+    # chunked body: counted while it is read, the app gets its length
+    with SpooledTemporaryFile(max_size=CHUNK) as body:
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] != 'http.request':
+                return
+            size += len(message.get('body', b''))
+            if size > limit:
+                return await too_large(send)
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        body.seek(0)
+
+        async def replay():
+            data = body.read(CHUNK)
+            return {'type': 'http.request', 'body': data, 'more_body': body.tell() < size}
+
+        # werkzeug doesn't read a body that is still marked as chunked
+        scope = dict(scope, headers=[(name, value) for name, value in scope['headers']
+                                     if name != b'transfer-encoding'] + [(b'content-length', str(size).encode())])
+        await wsgi_application(scope, replay, send)
@@ -0,0 +1,132 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from flask import request, send_from_directory
+
+# pip install Brotli
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Static files with the content hash in the name
+# flask --app app assets-build copies static/css/style.css to
+# static/dist/css/style.<hash>.css with .gz and .br next to it and writes
+# static/dist/manifest.json; url_for('static', filename='css/style.css')
+# then gives the hashed name, so the file can be cached forever
+# without manifest (no build, dev) the urls and files are the original ones
+
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+# uploads are content addressed already, see images.py
+SKIP_DIRS = {DIST_DIR, 'images/store', 'images/thumbs'}
+COMPRESS = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map'}
+# smaller files are not worth a second request header and cpu
+MIN_COMPRESS_BYTES = 512
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def file_hash(path, length=12):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:length]
+
+
+def source_files(static_dir):
+    for path, dirs, files in os.walk(static_dir):
+        rel_dir = os.path.relpath(path, static_dir).replace(os.sep, '/')
+        dirs[:] = [d for d in dirs if (d if rel_dir == '.' else f'{rel_dir}/{d}') not in SKIP_DIRS]
+        for file in files:
+            yield os.path.relpath(os.path.join(path, file), static_dir).replace(os.sep, '/')
+
+
+def compress(path):
+    # write path.gz and path.br, return the written variants
+    with open(path, 'rb') as f:
+        data = f.read()
+    variants = []
+    if len(data) < MIN_COMPRESS_BYTES:
+        return variants
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(gz) < len(data):
+        with open(path + '.gz', 'wb') as f:
+            f.write(gz)
+        variants.append('gzip')
+    if brotli is not None:
+        br = brotli.compress(data, quality=11)
+        if len(br) < len(data):
+            with open(path + '.br', 'wb') as f:
+                f.write(br)
+            variants.append('br')
+    return variants
+
+
+def build(static_dir):
+    # return the manifest {'css/style.css': 'dist/css/style.<hash>.css'}
+    # old hashed files stay, pages cached by browsers may still point to them
+    manifest = {}
+    for name in sorted(source_files(static_dir)):
+        stem, extension = os.path.splitext(name)
+        hashed = f'{DIST_DIR}/{stem}.{file_hash(os.path.join(static_dir, name))}{extension}'
+        target = os.path.join(static_dir, hashed)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(os.path.join(static_dir, name), target + '.tmp')
+            os.replace(target + '.tmp', target)
+            if extension.lower() in COMPRESS:
+                compress(target)
+        manifest[name] = hashed
+    path = os.path.join(static_dir, DIST_DIR, MANIFEST)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+    return manifest
+
+
+class Assets:
+    def __init__(self, app=None):
+        self.manifest = {}
+        self.static_dir = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.static_dir = app.static_folder
+        self.load()
+        app.url_defaults(self.hashed_url)
+        app.view_functions['static'] = self.send_static
+
+    def load(self):
+        try:
+            with open(os.path.join(self.static_dir, DIST_DIR, MANIFEST), encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+        return len(self.manifest)
+
+    def hashed_url(self, endpoint, values):
+        if endpoint == 'static' and values.get('filename') in self.manifest:
+            values['filename'] = self.manifest[values['filename']]
+
+    def send_static(self, filename):
+        if not filename.startswith(DIST_DIR + '/'):
+            return send_from_directory(self.static_dir, filename)
+        # precompressed variant the browser accepts, the hashed name never
+        # changes its content, so caches keep it for a year
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        for encoding, suffix in ENCODINGS:
+            if request.accept_encodings[encoding] and os.path.isfile(os.path.join(self.static_dir, filename + suffix)):
+                response = send_from_directory(self.static_dir, filename + suffix, mimetype=mimetype)
+                response.content_encoding = encoding
+                break
+        else:
+            response = send_from_directory(self.static_dir, filename, mimetype=mimetype)
+        response.vary.add('Accept-Encoding')
+        return response
@@ -0,0 +1,50 @@
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+# pip install "flask[async]" aiosqlite
+try:
+    import asgiref
+except ImportError:
+    asgiref = None
+
+# Async SQLAlchemy session for `async def` views
+# the url is SQLALCHEMY_DATABASE_URI with the async driver, or ASYNC_DATABASE_URL
+# https://docs.sqlalchemy.org/en/20/orm/extensions/asyncio.html
+# https://flask.palletsprojects.com/en/2.3.x/async-await/
+#
+# flask runs every async view in its own event loop, connections can't be
+# kept in a pool between requests, they belong to the loop that made them
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'mysql': 'mysql+aiomysql',
+}
+
+
+def async_url(url):
+    # 'sqlite:///flask.db' -> 'sqlite+aiosqlite:///flask.db'
+    scheme, rest = url.split('://', 1)
+    return ASYNC_DRIVERS.get(scheme, scheme) + '://' + rest
+
+
+class AsyncDB:
+    def __init__(self, app=None):
+        self.url = None
+        self.engine = None
+        self.sessionmaker = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.url = app.config.get('ASYNC_DATABASE_URL') or async_url(app.config['SQLALCHEMY_DATABASE_URI'])
+
+    def session(self):
+        # async with async_db.session() as session: ...
+        if asgiref is None:
+            raise RuntimeError('async views need: pip install "flask[async]" aiosqlite')
+        if self.engine is None:
+            connect_args = {'timeout': 30} if self.url.startswith('sqlite') else {}
+            self.engine = create_async_engine(self.url, poolclass=NullPool, connect_args=connect_args)
+            self.sessionmaker = async_sessionmaker(self.engine, expire_on_commit=False)
+        return self.sessionmaker()
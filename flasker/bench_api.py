@@ -0,0 +1,131 @@
+# benchmark: JSON API vs the HTML listing for reading all posts
+# walks all pages of /posts and of /api/posts with the next cursor,
+# reports posts/s and bytes per post; then the same pages again with
+# If-None-Match (304) and the peak memory of streamed pages of 100 and 1000
+# python bench_api.py                       -> 200 users, 5000 posts
+# python bench_api.py --posts 50000
+import argparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+NEXT_RE = re.compile(r'after=([\w-]+)')
+
+
+def walk_html(client, etags=None):
+    # return (posts, bytes, requests), etags: path -> etag of the page
+    path = '/posts'
+    posts = size = requests = 0
+    while path:
+        headers = {'If-None-Match': etags[path]} if etags and path in etags else {}
+        response = client.get(path, headers=headers)
+        body = response.get_data(as_text=True)
+        requests += 1
+        size += len(body)
+        if response.status_code == 304:
+            path = etags.get(path + '#next')
+            continue
+        posts += body.count('View Post')
+        after = NEXT_RE.search(body)
+        next_path = '/posts?after=' + after.group(1) if after else None
+        if etags is not None:
+            etags[path] = response.headers['ETag']
+            etags[path + '#next'] = next_path
+        path = next_path
+    return posts, size, requests
+
+
+def walk_api(client, limit, etags=None, fields=''):
+    path = f'/api/posts?limit={limit}{fields}'
+    posts = size = requests = 0
+    while path:
+        headers = {'If-None-Match': etags[path]} if etags and path in etags else {}
+        response = client.get(path, headers=headers)
+        requests += 1
+        size += len(response.get_data())
+        if response.status_code == 304:
+            # the next cursor of the page was remembered on the first walk
+            path = etags.get(path + '#next')
+            continue
+        data = response.get_json()
+        posts += len(data['posts'])
+        next_path = f"/api/posts?limit={limit}{fields}&after={data['next']}" if data['next'] else None
+        if etags is not None:
+            etags[path] = response.headers['ETag']
+            etags[path + '#next'] = next_path
+        path = next_path
+    return posts, size, requests
+
+
+def report(name, walk, *args):
+    start = time.perf_counter()
+    posts, size, requests = walk(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {requests:>6} requests {requests / elapsed:8.0f} req/s "
+          f"{posts / elapsed if posts else 0:9.0f} posts/s {size / max(posts, 1):8.0f} bytes/post")
+
+
+def streamed_peak(client, path):
+    # peak of python allocations while the response is read chunk by chunk
+    tracemalloc.start()
+    response = client.get(path, buffered=False)
+    size = sum(len(chunk) for chunk in response.response)
+    response.close()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return size, peak
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--posts', type=int, default=5000)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    # the file cache gives the etags of /api/posts and caches html pages,
+    # the first walks run with the cache off
+    os.environ.update(DATABASE_URL='sqlite:///' + os.path.join(tmp, 'bench.db'),
+                      JOBS_DB=os.path.join(tmp, 'jobs.db'), JOBS_WORKERS='0',
+                      CACHE_BACKEND='', RATE_LIMIT_BACKEND='', SESSION_BACKEND='memory',
+                      LOG_FILE=os.path.join(tmp, 'bench.log'))
+    sys.path.insert(0, BASE_DIR)
+    try:
+        import app as A
+        from bench_routes import seed
+        from page_cache import FileBackend
+
+        seed(A, args.users, args.posts)
+        A.page_cache.backend = FileBackend(os.path.join(tmp, 'cache'), A.app.config['CACHE_TTL'])
+        client = A.app.test_client()
+        per_page = A.app.config['POSTS_PER_PAGE']
+        print(f"{args.posts} posts, flask test client")
+        backend, A.page_cache.backend = A.page_cache.backend, None
+        report(f'html /posts ({per_page})', walk_html, client)
+        for limit in (per_page, 100, 1000):
+            report(f'api /api/posts ({limit})', walk_api, client, limit)
+        report('api with body_html (100)', walk_api, client, 100, None, '&fields=id,title,body_html')
+        A.page_cache.backend = backend
+
+        # first walk fills the cache and etags, the second one revalidates
+        html_etags, api_etags = {}, {}
+        walk_html(client, html_etags)
+        walk_api(client, per_page, api_etags)
+        report(f'html 304 ({per_page})', walk_html, client, html_etags)
+        report(f'api 304 ({per_page})', walk_api, client, per_page, api_etags)
+
+        # peak stays about the same when the page is 10 times bigger
+        A.page_cache.backend = None
+        path = '/api/posts?fields=id,title,body_html&limit='
+        streamed_peak(client, path + '10')
+        for limit in (100, 1000):
+            size, peak = streamed_peak(client, path + str(limit))
+            print(f"streamed page of {limit:<5} with body_html {size / 1024:8.0f} KB body, "
+                  f"peak {peak / 1024:6.0f} KB allocated")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
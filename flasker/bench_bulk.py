@@ -0,0 +1,52 @@
+# benchmark: rows/s of import-users, import-posts and export-posts
+# python bench_bulk.py [posts] [users]
+import json
+import os
+import sys
+import tempfile
+import time
+
+directory = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(directory, 'bench.db'))
+os.environ.setdefault('JOBS_DB', os.path.join(directory, 'jobs.db'))
+os.environ.setdefault('CACHE_DIR', os.path.join(directory, 'cache'))
+
+from app import app  # noqa: E402
+
+
+def write_jsonl(path, rows):
+    with open(path, 'w', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(row) + '\n')
+
+
+def run(args):
+    start = time.perf_counter()
+    result = app.test_cli_runner(mix_stderr=False).invoke(args=args)
+    if result.exit_code:
+        raise SystemExit(f'{args[0]} failed: {result.exception!r}\n{result.stderr}')
+    return time.perf_counter() - start
+
+
+def main(posts, users):
+    users_file = os.path.join(directory, 'users.jsonl')
+    posts_file = os.path.join(directory, 'posts.jsonl')
+    write_jsonl(users_file, ({'id': i, 'username': f'user{i}', 'name': f'User {i}', 'email': f'user{i}@example.com'}
+                             for i in range(1, users + 1)))
+    write_jsonl(posts_file, ({'title': f'Post {i}', 'content': f'<p>text of post {i} ' + 'word ' * 100 + '</p>',
+                              'slug': f'post-{i}', 'poster_id': i % users + 1}
+                             for i in range(posts)))
+    # tables are made on deploy, not on import of the app
+    run(['init-db'])
+    print(f"{'command':>14} {'rows':>9} {'rows/s':>9}")
+    for name, count, args in (
+            ('import-users', users, ['import-users', users_file, '--password', 'bench', '--chunk', '5000']),
+            ('import-posts', posts, ['import-posts', posts_file, '--chunk', '5000']),
+            ('export-posts', posts, ['export-posts', os.path.join(directory, 'out.jsonl'), '--chunk', '5000'])):
+        seconds = run(args)
+        print(f"{name:>14} {count:>9} {count / seconds:>9.0f}")
+
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:]]
+    main(*(args + [100000, 1000][len(args):]))
@@ -0,0 +1,65 @@
+# benchmark: rendering a page of posts from full content vs precomputed excerpt
+# python bench_listing.py            -> posts of 2k, 20k, 100k chars
+# python bench_listing.py 5000 50000
+import random
+import sys
+import time
+
+from jinja2 import Environment
+
+from sanitize import clean
+
+WORDS = ("flask python sqlite jinja template blog post user search index query "
+         "database migrate login form upload image cache server request").split()
+PER_PAGE = 10
+REPEAT = 50
+EXCERPT_LENGTH = 300
+
+# the listing as it was: every render strips the whole body
+FULL = Environment().from_string(
+    "{% for post in posts %}<h2>{{ post.title }}</h2>"
+    "{{ post.content|striptags|truncate(300) }}<br>{% endfor %}")
+# the listing now: the excerpt is made once on save
+EXCERPT = Environment().from_string(
+    "{% for post in posts %}<h2>{{ post.title }}</h2>"
+    "{{ post.excerpt }}<br>{% endfor %}")
+
+
+def make_content(rnd, chars):
+    parts = []
+    size = 0
+    while size < chars:
+        p = '<p>' + ' '.join(rnd.choices(WORDS, k=40)) + ' <b>bold</b> <a href="/x">link</a></p>'
+        parts.append(p)
+        size += len(p)
+    return ''.join(parts)
+
+
+def timed(func):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        func()
+    return (time.perf_counter() - start) / REPEAT * 1000
+
+
+def run(chars):
+    rnd = random.Random(42)
+    posts = []
+    for i in range(PER_PAGE):
+        content = make_content(rnd, chars)
+        start = time.perf_counter()
+        body_html, body_text = clean(content)
+        save_ms = (time.perf_counter() - start) * 1000
+        excerpt = body_text[:EXCERPT_LENGTH].rsplit(' ', 1)[0] + '...'
+        posts.append({'title': f'post {i}', 'content': content, 'excerpt': excerpt})
+    full = timed(lambda: FULL.render(posts=posts))
+    short = timed(lambda: EXCERPT.render(posts=posts))
+    print(f"{chars:>7} chars  full {full:8.2f} ms  excerpt {short:6.3f} ms  "
+          f"x{full / short:6.0f}  (sanitize on save {save_ms:.2f} ms/post)")
+
+
+if __name__ == '__main__':
+    sizes = [int(a) for a in sys.argv[1:]] or [2000, 20000, 100000]
+    print(f"render of one page, {PER_PAGE} posts, mean of {REPEAT}")
+    for size in sizes:
+        run(size)
@@ -0,0 +1,72 @@
+# benchmark: request latency with synchronous FileHandler vs MakeLog queue pipeline
+# python bench_logging.py [requests] [threads]
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask
+
+from MakeLog import MakeLog
+
+
+def make_app(logger):
+    app = Flask(__name__)
+
+    @app.route('/')
+    def index():
+        # like the views of app.py
+        logger.info("open /")
+        return 'ok'
+
+    return app
+
+
+def run(app, requests, threads):
+    client = app.test_client()
+
+    def one(_):
+        start = time.perf_counter()
+        client.get('/')
+        return (time.perf_counter() - start) * 1000
+
+    with ThreadPoolExecutor(threads) as pool:
+        start = time.perf_counter()
+        times = sorted(pool.map(one, range(requests)))
+        total = time.perf_counter() - start
+    return requests / total, statistics.median(times), times[int(len(times) * 0.99) - 1]
+
+
+def main(requests, threads):
+    # the pipeline of MakeLog is on the root logger, take it off for the sync run
+    root = logging.getLogger()
+    root.removeHandler(MakeLog.queue_handler)
+    directory = tempfile.mkdtemp()
+
+    sync_logger = logging.getLogger('bench.sync')
+    sync_logger.propagate = False
+    sync_handler = logging.FileHandler(os.path.join(directory, 'sync.log'), 'a', 'utf-8')
+    sync_handler.setFormatter(MakeLog.handler.formatter)
+    sync_logger.addHandler(sync_handler)
+    sync_logger.setLevel(logging.INFO)
+
+    queue_logger = logging.getLogger('bench.queue')
+    queue_logger.propagate = False
+    queue_logger.addHandler(MakeLog.queue_handler)
+    queue_logger.setLevel(logging.INFO)
+    MakeLog.listener.handlers = (MakeLog.handler,)
+
+    print(f"{'logging':>8} {'req/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, logger in (('sync', sync_logger), ('queue', queue_logger)):
+        rps, p50, p99 = run(make_app(logger), requests, threads)
+        print(f"{name:>8} {rps:>10.0f} {p50:>8.3f} {p99:>8.3f}")
+    MakeLog.stop()
+    print(f"dropped records: {MakeLog.dropped()}")
+
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:]]
+    main(*(args + [5000, 8][len(args):]))
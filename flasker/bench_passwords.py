@@ -0,0 +1,37 @@
+# benchmark: logins per second for every hashing cost
+# python bench_passwords.py [logins] [threads]
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask
+
+from passwords import PasswordPolicy
+
+METHODS = ['pbkdf2:sha256:100000', 'pbkdf2:sha256:260000', 'pbkdf2:sha256:600000',
+           'scrypt:16384:8:1', 'scrypt:32768:8:1']
+
+
+def main(logins, threads):
+    print(f"{'method':>22} {'hash ms':>8} {'logins/s':>9}")
+    for method in METHODS:
+        app = Flask(__name__)
+        app.config['PASSWORD_METHOD'] = method
+        app.config['PASSWORD_WORKERS'] = threads
+        policy = PasswordPolicy(app)
+        start = time.perf_counter()
+        password_hash = policy.hash('secret password')
+        hash_ms = (time.perf_counter() - start) * 1000
+        # request threads, more of them than hashing workers
+        with ThreadPoolExecutor(threads * 4) as clients:
+            start = time.perf_counter()
+            results = list(clients.map(lambda _: policy.verify(password_hash, 'secret password'), range(logins)))
+            total = time.perf_counter() - start
+        assert all(results)
+        policy.pool.shutdown()
+        print(f"{method:>22} {hash_ms:>8.1f} {logins / total:>9.1f}")
+
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:]]
+    main(*(args + [50, 4][len(args):]))
@@ -0,0 +1,54 @@
+# benchmark: cost of one rate limit check on the hot path
+# memory and sqlite backends, one key (all requests from one client) and
+# many keys (every request from another ip), 1 and 8 threads
+# python bench_rate_limit.py          -> 20000 checks per case
+# python bench_rate_limit.py 100000
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from rate_limit import MemoryBackend, SQLiteBackend
+
+# big limit, every check is allowed and writes the bucket
+RATE = 1000000.0
+CAPACITY = 1000000
+
+
+def worker(backend, keys, count, start):
+    for i in range(start, start + count):
+        backend.take(keys[i % len(keys)], RATE, CAPACITY)
+
+
+def run(backend, keys, count, threads):
+    per_thread = count // threads
+    pool = [threading.Thread(target=worker, args=(backend, keys, per_thread, n * per_thread))
+            for n in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return elapsed / (per_thread * threads) * 1000000
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    one_key = ['ip:127.0.0.1']
+    many_keys = [f'ip:10.{i // 65536}.{i // 256 % 256}.{i % 256}' for i in range(count)]
+    tmp = tempfile.mkdtemp()
+    try:
+        print(f"{count} checks, microseconds per check")
+        for threads in (1, 8):
+            for name, keys in (('one key', one_key), ('many keys', many_keys)):
+                memory = run(MemoryBackend(), keys, count, threads)
+                path = os.path.join(tmp, f'{threads}_{len(keys)}.db')
+                backend = SQLiteBackend(path)
+                backend.create_tables()
+                sqlite = run(backend, keys, count, threads)
+                print(f"{threads} threads  {name:<10} memory {memory:7.2f} us  sqlite {sqlite:8.2f} us")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
@@ -0,0 +1,370 @@
+# benchmark suite: every route of app.py with a mix of anonymous and logged in
+# clients, through the flask test client and a real local http server
+# reports requests/s, latency percentiles, sql queries (Server-Timing header)
+# and memory; results go to bench_results/routes_<time>.json
+# python bench_routes.py                          -> 100 users, 1000 posts, both modes
+# python bench_routes.py --users 1000 --posts 100000 --requests 5000 --concurrency 20
+# python bench_routes.py --mode client --compare bench_results/routes_old.json
+# python bench_routes.py --db flask.db            -> seed / reuse this db file
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+RESULTS_DIR = os.path.join(BASE_DIR, 'bench_results')
+PASSWORD = 'bench-password'
+WORDS = ("flask python sqlite jinja template blog post user search index query "
+         "database migrate login form upload image cache server request").split()
+TIMING_RE = re.compile(r'desc="(\d+) queries"')
+CSRF_RE = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+# clients: request(method, path, data) -> (status, headers, body)
+
+class TestClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code, response.headers, response.get_data()
+
+
+class HTTPClient:
+    # one connection per request, cookies of this client are kept
+    def __init__(self, port):
+        self.port = port
+        self.cookies = {}
+
+    def request(self, method, path, data=None):
+        headers = {}
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            content = response.read()
+        finally:
+            connection.close()
+        for cookie in response.headers.get_all('Set-Cookie') or []:
+            name, value = cookie.split(';', 1)[0].split('=', 1)
+            self.cookies[name] = value
+        return response.status, response.headers, content
+
+
+# routes: name -> (weight, logged in only, function(client, state, rnd) -> (method, path, data))
+
+def route_index(client, state, rnd):
+    return 'GET', '/', None
+
+
+def route_posts(client, state, rnd):
+    return 'GET', '/posts', None
+
+
+def route_post(client, state, rnd):
+    return 'GET', f'/posts/{rnd.randint(1, state["posts"])}', None
+
+
+def route_post_slug(client, state, rnd):
+    # seeded posts have slug post-<id - 1>
+    return 'GET', f'/posts/post-{rnd.randrange(state["posts"])}', None
+
+
+def route_search(client, state, rnd):
+    return 'POST', '/search', {'searched': rnd.choice(WORDS), 'csrf_token': state['csrf']}
+
+
+def route_login_page(client, state, rnd):
+    return 'GET', '/login', None
+
+
+def route_login(client, state, rnd):
+    return 'POST', '/login', {'username': state['username'], 'password': PASSWORD, 'csrf_token': state['csrf']}
+
+
+def route_dashboard(client, state, rnd):
+    return 'GET', '/dashboard', None
+
+
+def route_add_post(client, state, rnd):
+    n = rnd.randrange(10 ** 9)
+    return 'POST', '/add_post', {'title': f'bench {n}', 'slug': f'bench-{n}', 'csrf_token': state['csrf'],
+                                 'content': '<p>' + ' '.join(rnd.choices(WORDS, k=120)) + '</p>'}
+
+
+def route_add_user(client, state, rnd):
+    # new email every time, a taken one skips the password hashing
+    n = uuid.uuid4().hex[:12]
+    return 'POST', '/user/add', {'name': f'Bench {n}', 'username': f'bench{n}', 'email': f'bench{n}@example.com',
+                                 'password_hash': PASSWORD, 'password_hash2': PASSWORD,
+                                 'csrf_token': state['csrf']}
+
+
+def route_date(client, state, rnd):
+    return 'GET', '/date', None
+
+
+ROUTES = {
+    'index': (5, False, route_index),
+    'posts': (25, False, route_posts),
+    'post': (30, False, route_post),
+    'post_slug': (10, False, route_post_slug),
+    'search': (10, False, route_search),
+    'login_page': (4, False, route_login_page),
+    'login': (1, False, route_login),
+    'date': (5, False, route_date),
+    'dashboard': (8, True, route_dashboard),
+    'add_post': (3, True, route_add_post),
+    'add_user': (1, True, route_add_user),
+}
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def summary(samples, seconds):
+    latencies = sorted(s[1] for s in samples)
+    queries = [s[3] for s in samples if s[3] is not None]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for s in samples if s[2] >= 400),
+        'rps': round(len(samples) / seconds, 1) if seconds else 0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p90_ms': round(percentile(latencies, 0.90) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else 0,
+        'queries_mean': round(sum(queries) / len(queries), 2) if queries else None,
+        'queries_max': max(queries) if queries else None,
+    }
+
+
+def worker(make_client, index, count, state, samples, lock):
+    rnd = random.Random(index)
+    client = make_client()
+    state = dict(state, username=f'user{rnd.randrange(state["users"])}')
+    # token of this client's session, half of the clients log in
+    status, headers, body = client.request('GET', '/login')
+    state['csrf'] = CSRF_RE.search(body.decode()).group(1)
+    logged_in = index % 2 == 0
+    if logged_in:
+        client.request('POST', '/login', {'username': state['username'], 'password': PASSWORD,
+                                          'csrf_token': state['csrf']})
+    names = [name for name, (weight, auth, func) in ROUTES.items() if logged_in or not auth]
+    weights = [ROUTES[name][0] for name in names]
+    mine = []
+    for _ in range(count):
+        name = rnd.choices(names, weights)[0]
+        method, path, data = ROUTES[name][2](client, state, rnd)
+        start = time.perf_counter()
+        status, headers, body = client.request(method, path, data)
+        elapsed = time.perf_counter() - start
+        match = TIMING_RE.search(headers.get('Server-Timing') or '')
+        mine.append((name, elapsed, status, int(match.group(1)) if match else None))
+    with lock:
+        samples.extend(mine)
+
+
+def drive(make_client, requests, concurrency, state):
+    samples = []
+    lock = threading.Lock()
+    per_worker = max(1, requests // concurrency)
+    threads = [threading.Thread(target=worker, args=(make_client, i, per_worker, state, samples, lock))
+               for i in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    seconds = time.perf_counter() - start
+    routes = {name: summary([s for s in samples if s[0] == name], seconds) for name in ROUTES}
+    return {'total': summary(samples, seconds), 'seconds': round(seconds, 2), 'routes': routes}
+
+
+def rss_mb(pid='self'):
+    # (current, peak) resident memory of a process, linux only
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            fields = dict(line.split(':', 1) for line in f)
+        return (round(int(fields['VmRSS'].split()[0]) / 1024, 1),
+                round(int(fields['VmHWM'].split()[0]) / 1024, 1))
+    except (OSError, KeyError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return None, round(peak, 1)
+
+
+def seed(A, users, posts):
+    from sqlalchemy import func, insert
+    import search_index
+    with A.app.app_context():
+        A.create_db()
+        if A.db.session.scalar(func.count(A.Posts.id)):
+            print('db has posts, seeding skipped')
+            return A.db.session.scalar(func.count(A.User.id)), A.db.session.scalar(func.count(A.Posts.id))
+        rnd = random.Random(42)
+        # one hash for all, the cost of hashing is measured in login
+        password_hash = A.passwords.hash(PASSWORD)
+        A.db.session.execute(insert(A.User), [
+            {'username': f'user{i}', 'name': f'User {i}', 'email': f'user{i}@example.com',
+             'favorite_color': rnd.choice(['red', 'green', 'blue']), 'about_author': 'bench user',
+             'password_hash': password_hash} for i in range(users)])
+        now = datetime.now()
+        for start in range(0, posts, 1000):
+            rows = []
+            for i in range(start, min(start + 1000, posts)):
+                content = '<p>' + ' '.join(rnd.choices(WORDS, k=rnd.randint(50, 400))) + '</p>'
+                rows.append({'title': ' '.join(rnd.choices(WORDS, k=4)), 'content': content,
+                             'slug': f'post-{i}', 'poster_id': rnd.randint(1, users),
+                             'date_added': now - timedelta(minutes=posts - i),
+                             **A.render_content(content)})
+            A.db.session.execute(insert(A.Posts), rows)
+        A.db.session.commit()
+        with A.db.engine.begin() as conn:
+            search_index.rebuild(conn)
+    return users, posts
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def run_http(env, args, state):
+    port = free_port()
+    server = subprocess.Popen([sys.executable, '-m', 'flask', '--app', 'app', 'run', '--with-threads',
+                               '--no-reload', '--no-debugger', '--port', str(port)],
+                              cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise RuntimeError('server did not start')
+                time.sleep(0.2)
+        result = drive(lambda: HTTPClient(port), args.requests, args.concurrency, state)
+        result['memory_mb'], result['memory_peak_mb'] = rss_mb(server.pid)
+        return result
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def report(mode, result):
+    total = result['total']
+    print(f"\n{mode}: {total['requests']} requests in {result['seconds']}s, {total['rps']} req/s, "
+          f"p50 {total['p50_ms']} ms, p99 {total['p99_ms']} ms, errors {total['errors']}, "
+          f"memory {result['memory_mb']} MB (peak {result['memory_peak_mb']} MB)")
+    print(f"  {'route':<11} {'n':>6} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'queries':>8} {'errors':>6}")
+    for name, r in result['routes'].items():
+        print(f"  {name:<11} {r['requests']:>6} {r['p50_ms']:>8} {r['p90_ms']:>8} {r['p99_ms']:>8} "
+              f"{r['queries_mean'] if r['queries_mean'] is not None else '-':>8} {r['errors']:>6}")
+
+
+def compare(old, new):
+    # print change of p50 / p99 and req/s against an older result file
+    def change(a, b):
+        return f'{(b - a) / a * 100:+.0f}%' if a else '-'
+    for mode, result in new['results'].items():
+        before = old.get('results', {}).get(mode)
+        if not before:
+            continue
+        print(f"\n{mode} vs {old['meta']['time']}: req/s {change(before['total']['rps'], result['total']['rps'])}")
+        for name, r in result['routes'].items():
+            b = before['routes'].get(name)
+            if b:
+                print(f"  {name:<11} p50 {change(b['p50_ms'], r['p50_ms']):>6}  p99 {change(b['p99_ms'], r['p99_ms']):>6}"
+                      f"  queries {b['queries_mean']} -> {r['queries_mean']}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--posts', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=2000, help='requests of each mode')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--mode', choices=['client', 'http', 'both'], default='both')
+    parser.add_argument('--db', help='sqlite file to seed or reuse, temp file by default')
+    parser.add_argument('--no-cache', action='store_true', help='page cache off')
+    parser.add_argument('--out', help='json file, bench_results/routes_<time>.json by default')
+    parser.add_argument('--compare', help='older json result to compare with')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    db_path = os.path.abspath(args.db) if args.db else os.path.join(tmp, 'bench.db')
+    # the app reads these on import; rate limits would stop the bench clients,
+    # sql queries are read from the Server-Timing header
+    env = dict(os.environ,
+               DATABASE_URL='sqlite:///' + db_path,
+               SERVER_TIMING='1',
+               JOBS_DB=os.path.join(tmp, 'jobs.db'),
+               CACHE_DIR=os.path.join(tmp, 'cache'),
+               RATE_LIMIT_BACKEND='',
+               LOG_FILE=os.path.join(tmp, 'bench.log'))
+    if args.no_cache:
+        env['CACHE_BACKEND'] = ''
+    os.environ.update(env)
+    sys.path.insert(0, BASE_DIR)
+    try:
+        import app as A
+        users, posts = seed(A, args.users, args.posts)
+        state = {'users': users, 'posts': posts}
+        results = {}
+        if args.mode in ('client', 'both'):
+            results['client'] = drive(lambda: TestClient(A.app), args.requests, args.concurrency, state)
+            results['client']['memory_mb'], results['client']['memory_peak_mb'] = rss_mb()
+            report('client', results['client'])
+        if args.mode in ('http', 'both'):
+            results['http'] = run_http(env, args, state)
+            report('http', results['http'])
+        data = {
+            'meta': {'time': datetime.now().isoformat(timespec='seconds'), 'commit': git_commit(),
+                     'python': platform.python_version(), 'users': users, 'posts': posts,
+                     'requests': args.requests, 'concurrency': args.concurrency,
+                     'page_cache': not args.no_cache},
+            'results': results,
+        }
+        out = args.out or os.path.join(RESULTS_DIR, f"routes_{datetime.now():%Y%m%d_%H%M%S}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+        with open(out, 'w') as f:
+            json.dump(data, f, indent=1)
+        print(f'\nsaved {out}')
+        if args.compare:
+            with open(args.compare) as f:
+                compare(json.load(f), data)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
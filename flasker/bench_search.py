@@ -0,0 +1,67 @@
+# benchmark: LIKE '%term%' scan vs FTS5 index
+# python bench_search.py            -> 10k, 100k, 1M posts
+# python bench_search.py 10000 50000
+import random
+import sqlite3
+import sys
+import time
+
+from search_index import strip_html, make_query
+
+BASE = ("flask python sqlite jinja template blog post user search index query "
+        "database migrate login form upload image cache server request").split()
+# realistic vocabulary: common words plus a long tail of rare ones
+WORDS = BASE * 20 + [f"{w}{n}" for w in BASE for n in range(500)]
+TERMS = ["sqlite77", "jinja3 template12", "upload499", "notfoundword"]
+REPEAT = 5
+
+
+def seed(conn, count):
+    conn.execute("CREATE TABLE posts (id INTEGER PRIMARY KEY, title TEXT, content TEXT)")
+    conn.execute("CREATE VIRTUAL TABLE posts_fts USING fts5(title, body)")
+    rnd = random.Random(42)
+    batch = []
+    for i in range(1, count + 1):
+        title = ' '.join(rnd.choices(WORDS, k=4))
+        content = '<p>' + ' '.join(rnd.choices(WORDS, k=80)) + '</p>'
+        batch.append((i, title, content))
+        if len(batch) == 10000 or i == count:
+            conn.executemany("INSERT INTO posts VALUES (?, ?, ?)", batch)
+            conn.executemany("INSERT INTO posts_fts (rowid, title, body) VALUES (?, ?, ?)",
+                             [(r[0], r[1], strip_html(r[2])) for r in batch])
+            batch = []
+    conn.commit()
+
+
+def like(conn, term):
+    return conn.execute("SELECT id FROM posts WHERE content LIKE ? ORDER BY title LIMIT 50",
+                        ('%' + term + '%',)).fetchall()
+
+
+def fts(conn, term):
+    return conn.execute("SELECT rowid, snippet(posts_fts, 1, '[', ']', '...', 24) FROM posts_fts "
+                        "WHERE posts_fts MATCH ? ORDER BY bm25(posts_fts, 10.0, 1.0) LIMIT 50",
+                        (make_query(term),)).fetchall()
+
+
+def measure(func, conn):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        for term in TERMS:
+            func(conn, term)
+    return (time.perf_counter() - start) / (REPEAT * len(TERMS)) * 1000
+
+
+def main(sizes):
+    print(f"{'posts':>10} {'like ms':>10} {'fts ms':>10} {'speedup':>8}")
+    for count in sizes:
+        conn = sqlite3.connect(':memory:')
+        seed(conn, count)
+        like_ms = measure(like, conn)
+        fts_ms = measure(fts, conn)
+        print(f"{count:>10} {like_ms:>10.2f} {fts_ms:>10.2f} {like_ms / fts_ms:>7.1f}x")
+        conn.close()
+
+
+if __name__ == '__main__':
+    main([int(a) for a in sys.argv[1:]] or [10000, 100000, 1000000])
@@ -0,0 +1,150 @@
+# load test: sync server vs ASGI server, requests/s and p99 latency
+# starts every server on a temp db with seeded posts, then runs 10..1000
+# concurrent clients (asyncio, one connection per request) for each path
+#   sync  - flask run with threads, one thread per request (as app.run)
+#   asgi  - uvicorn asgi:application, sync views in its thread pool,
+#           /async/... views on the event loop
+# python bench_serving.py                       -> all servers, 10 100 1000 clients
+# python bench_serving.py --clients 10 50 --seconds 5
+# python bench_serving.py --url http://host:8000 --paths /posts   (running server)
+# pip install "flask[async]" aiosqlite uvicorn
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+SERVERS = {
+    'sync': [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--with-threads',
+             '--no-reload', '--no-debugger', '--port', '{port}'],
+    'asgi': [sys.executable, '-m', 'uvicorn', 'asgi:application', '--port', '{port}',
+             '--no-access-log', '--log-level', 'warning'],
+}
+PATHS = {
+    'sync': ['/posts', '/posts/1'],
+    'asgi': ['/posts', '/posts/1', '/async/posts', '/async/posts/1'],
+}
+POSTS = 200
+
+SEED = f"""
+import app as A
+with A.app.app_context():
+    A.create_db()
+    user = A.User(username='bench', name='Bench', email='bench@example.com', favorite_color='',
+                  about_author='', profile_pic=None, password_hash='x')
+    A.db.session.add(user)
+    A.db.session.commit()
+    A.db.session.add_all([A.Posts(title=f'Post {{i}}', content='<p>' + 'text ' * 200 + '</p>',
+                                  slug=f'post-{{i}}', poster_id=user.id) for i in range({POSTS})])
+    A.db.session.commit()
+"""
+
+
+async def fetch(host, port, path):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n'.encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    while await reader.read(65536):
+        pass
+    writer.close()
+    return status
+
+
+async def client(host, port, path, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            status = await fetch(host, port, path)
+        except (OSError, IndexError, ValueError):
+            errors.append(1)
+            await asyncio.sleep(0.01)
+            continue
+        if status == 200:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors.append(status)
+
+
+async def load(url, path, clients, seconds):
+    parts = urlsplit(url)
+    latencies = []
+    errors = []
+    deadline = time.perf_counter() + seconds
+    await asyncio.gather(*[client(parts.hostname, parts.port or 80, path, deadline, latencies, errors)
+                           for _ in range(clients)])
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0
+    return len(latencies) / seconds, p99, len(errors)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+def run_server(name, args, env):
+    port = free_port()
+    command = [part.format(port=port) for part in SERVERS[name]]
+    server = subprocess.Popen(command, cwd=BASE_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_port(port)
+        bench(name, f'http://127.0.0.1:{port}', args.paths or PATHS[name], args)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def bench(name, url, paths, args):
+    for path in paths:
+        for clients in args.clients:
+            rps, p99, errors = asyncio.run(load(url, path, clients, args.seconds))
+            print(f"{name:<5} {path:<16} {clients:>5} clients  {rps:8.0f} req/s  "
+                  f"p99 {p99:8.1f} ms  errors {errors}", flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--servers', nargs='+', default=list(SERVERS))
+    parser.add_argument('--paths', nargs='+')
+    parser.add_argument('--url', help='test a running server instead')
+    args = parser.parse_args()
+    if args.url:
+        bench('url', args.url, args.paths or ['/posts'], args)
+        sys.exit()
+    tmp = tempfile.mkdtemp()
+    try:
+        # database work is measured, not the page cache or rate limits
+        env = dict(os.environ,
+                   DATABASE_URL='sqlite:///' + os.path.join(tmp, 'bench.db'),
+                   JOBS_DB=os.path.join(tmp, 'jobs.db'),
+                   CACHE_BACKEND='',
+                   RATE_LIMIT_BACKEND='',
+                   LOG_FILE=os.path.join(tmp, 'bench.log'))
+        subprocess.run([sys.executable, '-c', SEED], cwd=BASE_DIR, env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+        for name in args.servers:
+            run_server(name, args, env)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
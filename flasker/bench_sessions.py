@@ -0,0 +1,70 @@
+# benchmark: signed cookie sessions vs server-side sessions (session_store.py)
+# per request cost when the session is only read and when it changes,
+# and the size of the cookie the browser sends back with every request
+# python bench_sessions.py           -> 5000 requests per case
+# python bench_sessions.py 20000
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from flask import Flask, flash, get_flashed_messages, session
+
+import session_store
+
+# what a logged in user of the site has in the session
+LOGGED_IN = {'_user_id': '12', '_fresh': True, '_id': hashlib.sha512(b'agent|ip').hexdigest(),
+             'csrf_token': hashlib.sha1(b'token').hexdigest(), 'db_primary_until': 1700000000.0}
+
+
+def make_app(backend, directory):
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'bench'
+    app.config['SESSION_BACKEND'] = backend
+    app.config['SESSION_DB'] = os.path.join(directory, f'sessions_{backend}.db')
+    session_store.init_app(app)
+    session_store.create_tables(app)
+
+    @app.route('/start')
+    def start():
+        session.update(LOGGED_IN)
+        return 'ok'
+
+    @app.route('/read')
+    def read():
+        return session.get('_user_id', '')
+
+    @app.route('/write')
+    def write():
+        flash('Blog Post submit success')
+        get_flashed_messages()
+        session['n'] = session.get('n', 0) + 1
+        return 'ok'
+
+    return app
+
+
+def run(app, path, count):
+    client = app.test_client()
+    client.get('/start')
+    start = time.perf_counter()
+    for _ in range(count):
+        client.get(path)
+    elapsed = time.perf_counter() - start
+    return elapsed / count * 1000000, len(client.get_cookie('session').value)
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    tmp = tempfile.mkdtemp()
+    try:
+        print(f"{count} requests, microseconds per request (test client)")
+        for backend in (None, 'memory', 'sqlite'):
+            app = make_app(backend, tmp)
+            read, size = run(app, '/read', count)
+            write, size = run(app, '/write', count)
+            print(f"{backend or 'cookie':<7} read {read:7.1f} us  write {write:7.1f} us  cookie {size} bytes")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
@@ -0,0 +1,81 @@
+# benchmark: readers and writers on one SQLite file, default settings vs db_engine
+# python bench_sqlite.py [seconds] [readers] [writers]
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+
+import db_engine
+
+
+def make_engine(path, tuned):
+    if not tuned:
+        # like the app before: default journal, 5 s lock timeout of sqlite3
+        return create_engine('sqlite:///' + path)
+    engine = create_engine('sqlite:///' + path, **db_engine.engine_options())
+
+    @event.listens_for(engine, 'connect')
+    def pragmas(dbapi_connection, connection_record):
+        for name, value in db_engine.SQLITE_PRAGMAS.items():
+            dbapi_connection.execute(f'PRAGMA {name} = {value}')
+
+    return engine
+
+
+def run(tuned, seconds, readers, writers):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    engine = make_engine(path, tuned)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE posts (id INTEGER PRIMARY KEY, title TEXT, content TEXT)"))
+        conn.execute(text("INSERT INTO posts (title, content) VALUES (:t, :c)"),
+                      [{'t': f'title {i}', 'c': 'x' * 2000} for i in range(2000)])
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    stop = time.monotonic() + seconds
+
+    def reader():
+        while time.monotonic() < stop:
+            try:
+                with engine.connect() as conn:
+                    conn.execute(text("SELECT id, title FROM posts ORDER BY id DESC LIMIT 20")).all()
+                key = 'reads'
+            except OperationalError:
+                key = 'errors'
+            with lock:
+                counts[key] += 1
+
+    def writer():
+        while time.monotonic() < stop:
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text("INSERT INTO posts (title, content) VALUES ('new', :c)"), {'c': 'y' * 2000})
+                key = 'writes'
+            except OperationalError:
+                key = 'errors'
+            with lock:
+                counts[key] += 1
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    engine.dispose()
+    return {k: v / seconds for k, v in counts.items()}
+
+
+def main(seconds, readers, writers):
+    print(f"{'engine':>8} {'reads/s':>9} {'writes/s':>9} {'errors/s':>9}")
+    for name, tuned in (('default', False), ('tuned', True)):
+        result = run(tuned, seconds, readers, writers)
+        print(f"{name:>8} {result['reads']:>9.0f} {result['writes']:>9.0f} {result['errors']:>9.1f}")
+
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:]]
+    main(*(args + [5, 8, 4][len(args):]))
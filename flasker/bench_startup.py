@@ -0,0 +1,84 @@
+# benchmark: import time and first responses of a fresh process
+# every run is a new python process with its own temp db:
+#   no cache      - templates compiled on the first hit, no bytecode cache
+#   cold cache    - bytecode cache dir is empty, first hit writes it
+#   warm cache    - compiled templates are loaded from the cache dir
+#   precompile    - warm cache and TEMPLATE_PRECOMPILE=1, all loaded on import
+# python bench_startup.py        -> 5 runs of each
+# python bench_startup.py 10
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+PAGES = ['/', '/posts', '/posts/1', '/login', '/add-user']
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import app as A
+imported = time.perf_counter() - start
+with A.app.app_context():
+    A.create_db()
+    user = A.User(username='bench', name='Bench', email='bench@example.com', favorite_color='',
+                  about_author='', profile_pic=None, password_hash='x')
+    A.db.session.add(user)
+    A.db.session.commit()
+    A.db.session.add(A.Posts(title='Post', content='<p>text</p>', slug='post', poster_id=user.id))
+    A.db.session.commit()
+client = A.app.test_client()
+times = {}
+for page in sys.argv[1:]:
+    start = time.perf_counter()
+    client.get(page)
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    client.get(page)
+    times[page] = (first, time.perf_counter() - start)
+print(json.dumps({'import': imported, 'pages': times}))
+"""
+
+
+def run(cache_dir, precompile):
+    tmp = tempfile.mkdtemp()
+    try:
+        env = dict(os.environ,
+                   DATABASE_URL='sqlite:///' + os.path.join(tmp, 'bench.db'),
+                   JOBS_DB=os.path.join(tmp, 'jobs.db'),
+                   TEMPLATE_CACHE_DIR=cache_dir,
+                   TEMPLATE_PRECOMPILE='1' if precompile else '0')
+        out = subprocess.run([sys.executable, '-c', CHILD] + PAGES, cwd=BASE_DIR, env=env,
+                             capture_output=True, text=True, check=True).stdout
+        return json.loads(out.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def report(name, results):
+    imported = statistics.median(r['import'] for r in results) * 1000
+    first = statistics.median(sum(t[0] for t in r['pages'].values()) for r in results) * 1000
+    again = statistics.median(sum(t[1] for t in r['pages'].values()) for r in results) * 1000
+    print(f"{name:<12} import {imported:7.1f} ms  first hits {first:7.1f} ms  "
+          f"second hits {again:6.1f} ms  import + first {imported + first:7.1f} ms")
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    cache_dir = tempfile.mkdtemp()
+    try:
+        print(f"median of {runs} runs, hits of {', '.join(PAGES)}")
+        report('no cache', [run('', False) for _ in range(runs)])
+        cold = []
+        for _ in range(runs):
+            shutil.rmtree(cache_dir)
+            os.makedirs(cache_dir)
+            cold.append(run(cache_dir, False))
+        report('cold cache', cold)
+        report('warm cache', [run(cache_dir, False) for _ in range(runs)])
+        report('precompile', [run(cache_dir, True) for _ in range(runs)])
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
@@ -0,0 +1,167 @@
+# memory benchmark: server RSS while large bodies are posted
+# starts the server on a temp db and upload folder, then sends
+#   upload   - profile pictures of --mb MB to /update/1 (multipart),
+#              the file is spooled to a temp file, not kept in memory
+#   refused  - 50 MB pictures with Content-Length: 413 before the body is read
+#   text     - 3 MB urlencoded posts to /add-post: 413, over its 2 MB limit
+#   chunked  - 3 MB chunked body to /login without Content-Length: 413 when
+#              the 256 KB limit is passed
+# and reports RSS of the server process (current and peak) after every case
+# rss doesn't grow with the number or the size of uploads; `flask run` reads
+# what the client sent of a refused body in 10 MB blocks (so the client gets
+# 413, not a reset), its rss goes up once by about that per client
+# python bench_uploads.py                       -> sync and asgi, 20 uploads of 4 MB
+# python bench_uploads.py --uploads 100 --clients 8 --servers sync
+import argparse
+import os
+import select
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_serving import SERVERS, free_port, wait_port
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+HOST = '127.0.0.1'
+REFUSED_MB = 50
+TEXT_MB = 3
+
+SEED = """
+import app as A
+with A.app.app_context():
+    A.create_db()
+    A.db.session.add(A.User(username='bench', name='Bench', email='bench@example.com', favorite_color='',
+                            about_author='', profile_pic=None, password_hash='x'))
+    A.db.session.commit()
+"""
+
+
+def memory(pid):
+    # (rss, peak rss) of the process in MB
+    values = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('VmRSS', 'VmHWM'):
+                values[key] = int(value.split()[0]) / 1024
+    return values['VmRSS'], values['VmHWM']
+
+
+def multipart(fields, filename, data):
+    boundary = uuid.uuid4().hex
+    parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+             for name, value in fields.items()]
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="profile_pic"; '
+                 f'filename="{filename}"\r\nContent-Type: image/png\r\n\r\n'.encode())
+    return f'multipart/form-data; boundary={boundary}', b''.join(parts), f'\r\n--{boundary}--\r\n'.encode()
+
+
+def pieces(head, size, tail):
+    # head, filler and tail of a body of `size` bytes
+    yield head
+    left = size - len(tail) - len(head)
+    chunk = b'x' * 65536
+    while left > 0:
+        yield chunk[:left]
+        left -= len(chunk)
+    yield tail
+
+
+def post(port, path, content_type, head, size, tail=b'', chunked=False):
+    # return (status, seconds); like a browser the rest of the body isn't sent
+    # when the server has answered already (413)
+    start = time.perf_counter()
+    with socket.create_connection((HOST, port)) as s:
+        length = 'Transfer-Encoding: chunked' if chunked else f'Content-Length: {size}'
+        s.sendall(f'POST {path} HTTP/1.1\r\nHost: {HOST}\r\nContent-Type: {content_type}\r\n'
+                  f'{length}\r\nConnection: close\r\n\r\n'.encode())
+        try:
+            for piece in pieces(head, size, tail):
+                if select.select([s], [], [], 0)[0]:
+                    break
+                s.sendall(b'%x\r\n%s\r\n' % (len(piece), piece) if chunked else piece)
+            if chunked:
+                s.sendall(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # the server answered and closed before the whole body
+            pass
+        status = int(s.makefile('rb').readline().split()[1])
+    return status, time.perf_counter() - start
+
+
+def case(name, pid, requests, clients, func, *args):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        results = list(pool.map(lambda _: func(*args), range(requests)))
+    elapsed = time.perf_counter() - start
+    statuses = sorted({status for status, _ in results})
+    slowest = max(seconds for _, seconds in results) * 1000
+    rss, peak = memory(pid)
+    print(f"{name:<8} {requests:>4} requests {elapsed:6.2f} s  slowest {slowest:7.1f} ms  "
+          f"status {statuses}  rss {rss:6.1f} MB  peak {peak:6.1f} MB", flush=True)
+
+
+def bench(name, pid, port, args):
+    fields = {'name': 'Bench', 'email': 'bench@example.com', 'favorite_color': '',
+              'about_author': '', 'username': 'bench'}
+    content_type, head, tail = multipart(fields, 'bench.png', b'')
+    # a request of every kind first, imports and caches are in the baseline
+    post(port, '/update/1', content_type, head, len(head) + 1024 + len(tail), tail)
+    rss, peak = memory(pid)
+    print(f"{name}: rss {rss:.1f} MB  peak {peak:.1f} MB at start", flush=True)
+    upload = len(head) + args.mb * 1024 * 1024 + len(tail)
+    case('upload', pid, args.uploads, args.clients,
+         post, port, '/update/1', content_type, head, upload, tail)
+    case('refused', pid, args.uploads, args.clients,
+         post, port, '/update/1', content_type, head, REFUSED_MB * 1024 * 1024, tail)
+    case('text', pid, args.uploads, args.clients,
+         post, port, '/add-post', 'application/x-www-form-urlencoded', b'content=',
+         TEXT_MB * 1024 * 1024)
+    case('chunked', pid, args.uploads, args.clients,
+         post, port, '/login', 'application/x-www-form-urlencoded', b'username=',
+         TEXT_MB * 1024 * 1024, b'', True)
+
+
+def run_server(name, args, env):
+    port = free_port()
+    command = [part.format(port=port) for part in SERVERS[name]]
+    server = subprocess.Popen(command, cwd=BASE_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_port(port)
+        bench(name, server.pid, port, args)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--uploads', type=int, default=20)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--mb', type=int, default=4, help='picture size, the limit is IMAGE_MAX_BYTES')
+    parser.add_argument('--servers', nargs='+', default=list(SERVERS))
+    args = parser.parse_args()
+    tmp = tempfile.mkdtemp()
+    try:
+        # jobs (thumbnails) are not run, only the requests are measured
+        env = dict(os.environ,
+                   DATABASE_URL='sqlite:///' + os.path.join(tmp, 'bench.db'),
+                   JOBS_DB=os.path.join(tmp, 'jobs.db'),
+                   JOBS_WORKERS='0',
+                   UPLOAD_FOLDER=os.path.join(tmp, 'images'),
+                   CACHE_BACKEND='',
+                   RATE_LIMIT_BACKEND='',
+                   SESSION_BACKEND='memory',
+                   LOG_FILE=os.path.join(tmp, 'bench.log'))
+        subprocess.run([sys.executable, '-c', SEED], cwd=BASE_DIR, env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+        for name in args.servers:
+            run_server(name, args, env)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
@@ -0,0 +1,85 @@
+from tempfile import SpooledTemporaryFile
+
+from flask import Request, current_app, request
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+from werkzeug.utils import cached_property
+from werkzeug.wsgi import LimitedStream, get_input_stream
+
+# Size limits of request bodies, per endpoint
+# app.config['MAX_CONTENT_LENGTH']    bytes of a body, views without own limit
+# app.config['MAX_FORM_MEMORY_SIZE']  bytes of text form fields, they are kept
+#                                     in memory (a urlencoded form as a whole)
+# app.config['BODY_LIMITS'] = {'dashboard': (body bytes, form memory bytes)}
+# app.config['UPLOAD_SPOOL_BYTES']    uploaded files over it go to a temp file
+#                                     (UPLOAD_SPOOL_DIR), not memory
+# https://flask.palletsprojects.com/en/2.3.x/patterns/fileuploads/#improving-uploads
+#
+# Content-Length over the limit is 413 before anything of the body is read;
+# a body without it (chunked) is cut with 413 when it passes the limit
+
+
+def limits_of(app, endpoint):
+    # (body bytes, form memory bytes) of the endpoint
+    limits = app.config.get('BODY_LIMITS', {}).get(endpoint)
+    if limits:
+        return limits
+    return app.config.get('MAX_CONTENT_LENGTH'), app.config.get('MAX_FORM_MEMORY_SIZE')
+
+
+class MaxStream(LimitedStream):
+    # werkzeug 2.3.4 stops a chunked body at the limit without an error and the
+    # view gets it cut; one byte over the limit is read to tell it is too large
+    def __init__(self, stream, limit):
+        super().__init__(stream, limit + 1, is_max=True)
+        self.max = limit
+
+    def readinto(self, b):
+        size = super().readinto(b)
+        if self._pos > self.max:
+            raise RequestEntityTooLarge()
+        return size
+
+
+class LimitedRequest(Request):
+    def _limits(self):
+        endpoint = self.url_rule.endpoint if self.url_rule is not None else None
+        return limits_of(current_app, endpoint)
+
+    @property
+    def max_content_length(self):
+        return self._limits()[0] if current_app else None
+
+    @property
+    def max_form_memory_size(self):
+        return self._limits()[1] if current_app else None
+
+    @cached_property
+    def stream(self):
+        limit = self.max_content_length
+        if limit is not None and self.environ.get('wsgi.input_terminated'):
+            return MaxStream(self.environ['wsgi.input'], limit)
+        return get_input_stream(self.environ, max_content_length=limit)
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return SpooledTemporaryFile(max_size=current_app.config.get('UPLOAD_SPOOL_BYTES', 64 * 1024),
+                                    mode='rb+', dir=current_app.config.get('UPLOAD_SPOOL_DIR'))
+
+
+def reject_early():
+    limit = request.max_content_length
+    if limit is not None and request.content_length is not None and request.content_length > limit:
+        raise RequestEntityTooLarge()
+
+
+def limit_of_path(app, method, path):
+    # body limit of the view of the url, for a server in front of the app (asgi.py)
+    try:
+        endpoint = app.url_map.bind('').match(path, method)[0]
+    except HTTPException:
+        endpoint = None
+    return limits_of(app, endpoint)[0]
+
+
+def init_app(app):
+    app.request_class = LimitedRequest
+    app.before_request(reject_early)
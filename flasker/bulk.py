@@ -0,0 +1,98 @@
+import contextlib
+import csv
+import json
+import sys
+import time
+from datetime import datetime
+from itertools import islice
+
+# Streaming import / export of table rows in jsonl or csv
+# rows are read and written one by one, the db gets them in chunks,
+# so memory doesn't grow with the file size
+
+
+def file_format(path):
+    if path.endswith('.csv'):
+        return 'csv'
+    if path.endswith('.jsonl') or path.endswith('.json') or path == '-':
+        return 'jsonl'
+    raise ValueError(f'unknown format of {path}, use .jsonl or .csv')
+
+
+def open_file(path, mode='r'):
+    # '-' is stdin / stdout
+    if path == '-':
+        return contextlib.nullcontext(sys.stdin if mode == 'r' else sys.stdout)
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+def read_rows(f, fmt):
+    if fmt == 'csv':
+        for row in csv.DictReader(f):
+            yield {k: (v if v != '' else None) for k, v in row.items()}
+    else:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def write_rows(f, fmt, fields, rows, progress=None):
+    if fmt == 'csv':
+        writer = csv.writer(f)
+        writer.writerow(fields)
+        for row in rows:
+            writer.writerow([_value(v) for v in row])
+            if progress:
+                progress.add(1)
+    else:
+        for row in rows:
+            f.write(json.dumps({k: _value(v) for k, v in zip(fields, row)}, ensure_ascii=False))
+            f.write('\n')
+            if progress:
+                progress.add(1)
+
+
+def chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def parse_date(value):
+    if not value:
+        return datetime.now()
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+class Progress:
+    # prints rows and rows/s to stderr not more often than every `every` seconds
+    def __init__(self, name, every=2.0, out=sys.stderr):
+        self.name = name
+        self.every = every
+        self.out = out
+        self.count = 0
+        self.start = self.last = time.perf_counter()
+
+    def add(self, count):
+        self.count += count
+        now = time.perf_counter()
+        if now - self.last >= self.every:
+            self.last = now
+            self.report()
+
+    def rate(self):
+        return self.count / max(time.perf_counter() - self.start, 1e-9)
+
+    def report(self):
+        print(f'{self.name}: {self.count} rows, {self.rate():.0f} rows/s', file=self.out)
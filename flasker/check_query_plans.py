@@ -0,0 +1,135 @@
+# query plan check: every sql query the pages issue on a big seeded db
+# goes through EXPLAIN QUERY PLAN, a full table scan or a temp b-tree sort
+# fails the check (exit code 1), so a missing index is found before deploy
+# https://www.sqlite.org/eqp.html
+# python check_query_plans.py                    -> 2000 users, 20000 posts
+# python check_query_plans.py --posts 100000 --verbose
+import argparse
+import io
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+# "SCAN posts" - whole table, "SCAN posts USING INDEX ix" - walks an index
+FULL_SCAN_RE = re.compile(r'^SCAN (\w+)$')
+TEMP_SORT = 'USE TEMP B-TREE'
+# small system tables, looked up by name
+ALLOWED_SCANS = {'sqlite_master', 'sqlite_schema'}
+CHECKED = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+
+
+def problems(plan):
+    found = []
+    # fts results are ordered by rank, it is computed for the matched rows only
+    ranked = any('VIRTUAL TABLE' in row[-1] for row in plan)
+    for row in plan:
+        detail = row[-1]
+        match = FULL_SCAN_RE.match(detail)
+        if match and match.group(1) not in ALLOWED_SCANS:
+            found.append(f'full scan of {match.group(1)}')
+        if TEMP_SORT in detail and not ranked:
+            found.append(detail.lower())
+    return found
+
+
+def visit_pages(A, client, users, posts):
+    # every page with the queries it makes, writes go last
+    import search_index
+    client.post('/login', data={'username': 'user1', 'password': 'bench-password'})
+    body = client.get('/posts').get_data(as_text=True)
+    after = re.search(r'after=([\w-]+)', body)
+    if after:
+        client.get('/posts?after=' + after.group(1))
+    middle = posts // 2
+    api = client.get('/api/posts?limit=100').get_json()
+    client.get('/api/posts?fields=id,body_html&after=' + api['next'])
+    for path in ['/', f'/posts/{middle}', f'/posts/post-{middle}', '/posts/no-such-slug',
+                 f'/posts/edit/{middle}', '/user/User%205', '/user/add', '/update/2', '/dashboard',
+                 '/admin', '/date', f'/api/posts/{middle}', '/api/users/2']:
+        client.get(path)
+    client.post('/search', data={'searched': 'sqlite template'})
+    # search without fts, the LIKE fallback
+    enabled = search_index.enabled
+    search_index.enabled = False
+    client.post('/search', data={'searched': 'sqlite'})
+    search_index.enabled = enabled
+    client.post('/test_pw', data={'email': 'user3@example.com', 'password_hash': 'bench-password'})
+    client.post('/user/add', data={'name': 'Plan', 'username': 'plan', 'email': 'plan@example.com',
+                                   'password_hash': 'x', 'password_hash2': 'x'})
+    client.post('/add_post', data={'title': 'plan', 'slug': 'plan', 'content': '<p>plan check</p>'})
+    client.post(f'/posts/edit/{middle}', data={'title': 'plan', 'slug': 'plan', 'content': '<p>edited</p>'})
+    # the old slug is a redirect now
+    client.get(f'/posts/post-{middle - 1}')
+    if A.images.Image is not None:
+        # the second picture replaces the first one, that looks who else has it
+        for color in ('red', 'blue'):
+            picture = io.BytesIO()
+            A.images.Image.new('RGB', (8, 8), color).save(picture, 'PNG')
+            picture.seek(0)
+            data = {'name': 'User 1', 'username': 'user1', 'email': 'user1@example.com',
+                    'favorite_color': 'red', 'about_author': 'x', 'profile_pic': (picture, 'p.png')}
+            client.post('/dashboard', data=data, content_type='multipart/form-data')
+    # the post added above, then user1 (id 2, seeded from user0) with all posts
+    client.get(f'/posts/delete/{posts + 1}')
+    client.get('/delete/2')
+    # thumbnails, old picture, search index
+    A.job_queue.drain()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--posts', type=int, default=20000)
+    parser.add_argument('--verbose', action='store_true', help='print plans of all queries')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    # pages must reach the db: no page cache, no rate limits;
+    # jobs are run here after the pages, their queries are checked too
+    os.environ.update(DATABASE_URL='sqlite:///' + os.path.join(tmp, 'plans.db'),
+                      JOBS_DB=os.path.join(tmp, 'jobs.db'), JOBS_WORKERS='0',
+                      CACHE_BACKEND='', RATE_LIMIT_BACKEND='', SESSION_BACKEND='memory',
+                      LOG_FILE=os.path.join(tmp, 'plans.log'))
+    sys.path.insert(0, BASE_DIR)
+    failed = 0
+    try:
+        import app as A
+        from bench_routes import seed
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        users, posts = seed(A, args.users, args.posts)
+        A.app.config['WTF_CSRF_ENABLED'] = False
+        A.app.config['UPLOAD_FOLDER'] = os.path.join(tmp, 'images')
+        # the old picture is removed by the drain at the end, not an hour later
+        A.app.config['IMAGE_GRACE'] = 0
+        statements = {}
+
+        @event.listens_for(Engine, 'before_cursor_execute')
+        def remember(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith(CHECKED) and 'EXPLAIN' not in statement:
+                statements.setdefault(statement, parameters[0] if executemany else parameters)
+
+        visit_pages(A, A.app.test_client(), users, posts)
+        event.remove(Engine, 'before_cursor_execute', remember)
+        with A.app.app_context():
+            connection = A.db.engine.raw_connection()
+            try:
+                for statement, parameters in statements.items():
+                    plan = connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+                    found = problems(plan)
+                    failed += bool(found)
+                    if found or args.verbose:
+                        print(('FAIL ' + ', '.join(found) if found else 'ok') + ':')
+                        print('  ' + ' '.join(statement.split())[:300])
+                        for row in plan:
+                            print('    ' + row[-1])
+            finally:
+                connection.close()
+        print(f'{len(statements)} queries checked, {failed} with full scan or temp sort')
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,119 @@
+import random
+import sqlite3
+import time
+from functools import wraps
+
+from flask import g, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+
+# Database engines: primary and read replicas
+# DATABASE_URL           primary, any SQLAlchemy url, default sqlite flask.db
+# DATABASE_REPLICA_URLS  read replicas, comma separated
+# views marked with @read_replica read from a random replica, everything
+# else and every flush goes to the primary; after a commit the client reads
+# from the primary for STICKY_SECONDS, so it sees its own writes
+# locally replicas may be copies of the sqlite file or the same file:
+# DATABASE_REPLICA_URLS=sqlite:////path/flask.db,sqlite:////path/flask.db
+
+REPLICA_PREFIX = 'replica_'
+STICKY_SECONDS = 10
+
+# SQLite settings for many threads
+# https://www.sqlite.org/wal.html
+# https://www.sqlite.org/pragma.html
+# WAL: readers don't wait for the writer and the writer doesn't wait for readers,
+# busy_timeout: a writer waits for another writer instead of "database is locked"
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    # with WAL, NORMAL is safe for the db, last commits may be lost on power off
+    'synchronous': 'NORMAL',
+    # negative - KiB, 20 MB of page cache per connection
+    'cache_size': -20000,
+    'mmap_size': 256 * 1024 * 1024,
+    'busy_timeout': 30000,
+    'temp_store': 'MEMORY',
+}
+
+
+def in_memory(url):
+    # sqlite:// or sqlite:///:memory: - one connection for all (StaticPool)
+    url = make_url(url)
+    return url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory'
+
+
+def engine_options(url='sqlite://', pool_size=10, max_overflow=10, timeout=30):
+    # for app.config['SQLALCHEMY_ENGINE_OPTIONS'] and binds
+    if not url.startswith('sqlite'):
+        return {'pool_size': pool_size, 'max_overflow': max_overflow, 'pool_pre_ping': True}
+    # connection is used by one thread at a time, the pool gives it to others
+    options = {'connect_args': {'timeout': timeout, 'check_same_thread': False}}
+    if not in_memory(url):
+        options.update(pool_size=pool_size, max_overflow=max_overflow)
+    return options
+
+
+def replica_binds(urls):
+    # for app.config['SQLALCHEMY_BINDS']
+    return {f'{REPLICA_PREFIX}{i}': {'url': url, **engine_options(url)}
+            for i, url in enumerate(urls)}
+
+
+def read_replica(view):
+    # the view only reads, its queries may go to a replica
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.read_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _use_replica():
+    if not has_request_context() or not g.get('read_replica'):
+        return False
+    # read your writes
+    return session.get('db_primary_until', 0) < time.time()
+
+
+def _replicas(db):
+    return [key for key in db.engines if key and key.startswith(REPLICA_PREFIX)]
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and _use_replica():
+            replicas = _replicas(self._db)
+            if replicas:
+                # one replica for the whole request
+                if 'replica' not in g:
+                    g.replica = random.choice(replicas)
+                return self._db.engines[g.replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _wrote(db_session, flush_context):
+    if has_request_context():
+        g.db_wrote = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _stick_to_primary(db_session):
+    # without replicas every read is from the primary, the session isn't changed
+    if has_request_context() and g.pop('db_wrote', False) and _replicas(db_session._db):
+        session['db_primary_until'] = time.time() + STICKY_SECONDS
+
+
+def init_app(app):
+    pragmas = app.config.get('SQLITE_PRAGMAS', SQLITE_PRAGMAS)
+
+    @event.listens_for(Engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
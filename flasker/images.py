@@ -0,0 +1,153 @@
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+# pip install Pillow
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Profile pictures
+# upload is copied to disk in chunks with a size cap, thumbnails are made
+# in a background job (app.py), so the request doesn't wait for image decoding
+#
+# files are named by sha256 of the content: store/ab/cd/abcd...ef.jpg,
+# the same picture is kept once, the name never points to other content,
+# so urls can be cached forever
+# thumbnails: store/ab/cd/abcd...ef_<size>.webp next to the picture,
+# thumbs/<name>_<size>.webp for pictures uploaded before the store
+
+CHUNK_SIZE = 64 * 1024
+SIZES = (40, 150, 300)
+STORE_DIR = 'store'
+THUMB_DIR = 'thumbs'
+THUMB_FORMAT = 'webp'
+EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'}
+# uuid1 names of the old uploads
+LEGACY_RE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}_')
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def store_name(digest, extension):
+    return f"{STORE_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+
+def save_upload(file, directory, max_bytes):
+    # return the file name in the store, raise UploadTooLarge over max_bytes
+    extension = os.path.splitext(file.filename or '')[1].lower()
+    if extension not in EXTENSIONS:
+        extension = ''
+    os.makedirs(os.path.join(directory, STORE_DIR), exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=os.path.join(directory, STORE_DIR), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f'upload is bigger than {max_bytes} bytes')
+                digest.update(chunk)
+                f.write(chunk)
+        name = store_name(digest.hexdigest(), extension)
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            # same picture is in the store already, fresh mtime keeps it from gc
+            os.remove(tmp)
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return name
+
+
+def thumb_name(name, size):
+    if name.startswith(STORE_DIR + '/'):
+        return f"{os.path.splitext(name)[0]}_{size}.{THUMB_FORMAT}"
+    return f"{THUMB_DIR}/{os.path.splitext(name)[0]}_{size}.{THUMB_FORMAT}"
+
+
+def picture_files(directory, name):
+    # picture and its thumbnails
+    return [os.path.join(directory, n) for n in [name] + [thumb_name(name, s) for s in SIZES]]
+
+
+def thumbnails_exist(directory, name):
+    return all(os.path.exists(os.path.join(directory, thumb_name(name, s))) for s in SIZES)
+
+
+def remove_picture(directory, name):
+    # return freed bytes
+    freed = 0
+    for path in picture_files(directory, name):
+        try:
+            freed += os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            pass
+    return freed
+
+
+def stored_pictures(directory):
+    # names of all pictures in the store and of the old uploads
+    root = os.path.join(directory, STORE_DIR)
+    for path, dirs, files in os.walk(root):
+        for file in files:
+            stem, extension = os.path.splitext(file)
+            if extension == '.tmp' or re.search(r'_\d+$', stem):
+                continue
+            yield os.path.relpath(os.path.join(path, file), directory).replace(os.sep, '/')
+    for file in os.listdir(directory):
+        if LEGACY_RE.match(file) and os.path.isfile(os.path.join(directory, file)):
+            yield file
+
+
+def recently_saved(directory, name, grace, now=None):
+    # saved or uploaded again less than grace seconds ago, save_upload
+    # touches a picture that is in the store already
+    try:
+        return (now or time.time()) - os.path.getmtime(os.path.join(directory, name)) < grace
+    except OSError:
+        return False
+
+
+def collect_garbage(directory, referenced, grace=3600):
+    # remove pictures nobody points to, older than grace seconds
+    # (a new upload may be on disk before its db commit)
+    removed = 0
+    freed = 0
+    now = time.time()
+    for name in list(stored_pictures(directory)):
+        if name in referenced or recently_saved(directory, name, grace, now):
+            continue
+        freed += remove_picture(directory, name)
+        removed += 1
+    return removed, freed
+
+
+def make_thumbnails(directory, name):
+    os.makedirs(os.path.dirname(os.path.join(directory, thumb_name(name, SIZES[0]))), exist_ok=True)
+    with Image.open(os.path.join(directory, name)) as image:
+        # phone photos keep rotation in exif
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        for size in SIZES:
+            thumb = image.copy()
+            thumb.thumbnail((size, size))
+            path = os.path.join(directory, thumb_name(name, size))
+            thumb.save(path + '.tmp', THUMB_FORMAT.upper(), quality=80, method=4)
+            os.replace(path + '.tmp', path)
+
@@ -0,0 +1,256 @@
+import json
+import random
+import sqlite3
+import threading
+import time
+import traceback
+from collections import namedtuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from sqlite_local import LocalConnection
+
+# Background jobs for the work a request doesn't have to wait for
+# (thumbnails, removing old pictures, search index of posts)
+# app.config['JOBS_DB']       sqlite file with the jobs table, shared by all
+#                             workers of the host, jobs survive restarts
+# app.config['JOBS_WORKERS']  threads of this process running jobs, they start
+#                             with the first request; 0 - only `flask jobs work`
+#
+# @job_queue.task('thumbnails')           def f(user_id, name): ...
+# job_queue.enqueue('thumbnails', 5, 'a.png', key='thumbnails:5')
+# job_queue.after_commit(session, ...)    the same when the session commits
+#
+# a job is tried max_attempts times, waiting backoff * 2^n seconds between;
+# a claimed job holds a lease of JOBS_TIMEOUT seconds, after a crash it is
+# taken again when the lease is over
+# key: while a job with the key waits, the same job is not added again,
+# the waiting one gets the new arguments
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+STATES = (QUEUED, RUNNING, DONE, FAILED)
+CLEANUP_SECONDS = 300
+
+Job = namedtuple('Job', 'id name args key state attempts max_attempts run_at created finished error')
+
+
+class JobQueue:
+    def __init__(self, app=None, logger=None):
+        self.app = None
+        self.logger = logger
+        self.tasks = {}
+        self.retries = {}
+        # set by enqueue, workers wait for it or poll for other processes' jobs
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.threads = []
+        self.start_lock = threading.Lock()
+        self.last_cleanup = time.time()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.path = app.config['JOBS_DB']
+        self.workers = app.config.get('JOBS_WORKERS', 2)
+        self.poll = app.config.get('JOBS_POLL', 1.0)
+        self.timeout = app.config.get('JOBS_TIMEOUT', 300)
+        self.backoff = app.config.get('JOBS_BACKOFF', 5)
+        self.keep = app.config.get('JOBS_KEEP', 24 * 3600)
+        self._connection = LocalConnection(self.path, timeout=30)
+        event.listen(Session, 'after_commit', self._session_committed)
+        event.listen(Session, 'after_rollback', self._session_rolled_back)
+        if self.workers:
+            app.before_request(self.start)
+
+    def create_tables(self):
+        # flask --app app init-db
+        connection = self._connection()
+        connection.execute("CREATE TABLE IF NOT EXISTS jobs "
+                           "(id INTEGER PRIMARY KEY, name TEXT NOT NULL, args TEXT NOT NULL, key TEXT, "
+                           "state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+                           "max_attempts INTEGER NOT NULL, run_at REAL NOT NULL, created REAL NOT NULL, "
+                           "finished REAL, error TEXT)")
+        # run_at: not before for queued jobs, end of the lease for running ones
+        connection.execute("CREATE INDEX IF NOT EXISTS ix_jobs_ready ON jobs (run_at) "
+                           "WHERE state IN ('queued', 'running')")
+        connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_jobs_key ON jobs (key) WHERE state = 'queued'")
+        connection.execute("CREATE INDEX IF NOT EXISTS ix_jobs_finished ON jobs (state, finished)")
+
+    def task(self, name, retries=3):
+        def decorator(func):
+            self.tasks[name] = func
+            self.retries[name] = retries
+            return func
+        return decorator
+
+    # adding jobs
+    def enqueue(self, name, *args, key=None, delay=0):
+        if name not in self.tasks:
+            raise LookupError(f'unknown job {name}')
+        now = time.time()
+        self._connection().execute(
+            "INSERT INTO jobs (name, args, key, state, max_attempts, run_at, created) "
+            "VALUES (?, ?, ?, 'queued', ?, ?, ?) "
+            "ON CONFLICT (key) WHERE state = 'queued' "
+            "DO UPDATE SET args = excluded.args, run_at = min(run_at, excluded.run_at)",
+            (name, json.dumps(args), key, self.retries[name] + 1, now + delay, now))
+        self.wakeup.set()
+
+    def after_commit(self, session, name, *args, key=None, delay=0):
+        # the job sees the committed rows, nothing is added on rollback
+        session.info.setdefault('jobs', []).append((name, args, key, delay))
+
+    def _session_committed(self, session):
+        for name, args, key, delay in session.info.pop('jobs', []):
+            self.enqueue(name, *args, key=key, delay=delay)
+
+    def _session_rolled_back(self, session):
+        session.info.pop('jobs', None)
+
+    # running jobs
+    def claim(self):
+        now = time.time()
+        connection = self._connection()
+        ready = "FROM jobs WHERE state IN ('queued', 'running') AND run_at <= ?"
+        # read first, idle workers don't take the write lock
+        if connection.execute("SELECT 1 " + ready + " LIMIT 1", (now,)).fetchone() is None:
+            return None
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            while True:
+                row = connection.execute("SELECT * " + ready + " ORDER BY run_at LIMIT 1", (now,)).fetchone()
+                if row is None:
+                    job = None
+                    break
+                job = Job(*row)
+                if job.state == RUNNING and job.attempts >= job.max_attempts:
+                    # the worker died on the last attempt
+                    connection.execute("UPDATE jobs SET state = 'failed', finished = ?, error = ? WHERE id = ?",
+                                       (now, 'lease expired', job.id))
+                    continue
+                connection.execute("UPDATE jobs SET state = 'running', attempts = attempts + 1, run_at = ? "
+                                   "WHERE id = ?", (now + self.timeout, job.id))
+                job = job._replace(state=RUNNING, attempts=job.attempts + 1, args=json.loads(job.args))
+                break
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return job
+
+    def run(self, job):
+        func = self.tasks.get(job.name)
+        try:
+            if func is None:
+                raise LookupError(f'unknown job {job.name}')
+            with self.app.app_context():
+                func(*job.args)
+        except Exception:
+            if self.logger:
+                self.logger.exception(f'job {job.id} {job.name} failed, attempt {job.attempts}')
+            self._failed(job, traceback.format_exc(limit=5), retry=func is not None)
+            return False
+        self._connection().execute("UPDATE jobs SET state = 'done', finished = ?, error = NULL WHERE id = ?",
+                                   (time.time(), job.id))
+        return True
+
+    def _failed(self, job, error, retry=True):
+        now = time.time()
+        if retry and job.attempts < job.max_attempts:
+            # 5, 10, 20... seconds, spread a bit so failed jobs don't come back together
+            wait = self.backoff * 2 ** (job.attempts - 1) * random.uniform(1, 1.2)
+            self._connection().execute("UPDATE jobs SET state = 'queued', run_at = ?, error = ? WHERE id = ?",
+                                       (now + wait, error, job.id))
+        else:
+            self._connection().execute("UPDATE jobs SET state = 'failed', finished = ?, error = ? WHERE id = ?",
+                                       (now, error, job.id))
+
+    def drain(self):
+        # run ready jobs in this thread until there are none, return how many ran
+        count = 0
+        while True:
+            job = self.claim()
+            if job is None:
+                return count
+            self.run(job)
+            count += 1
+
+    def _work(self):
+        while not self.stopping.is_set():
+            self._cleanup()
+            # cleared before the look, a job added after it sets it again
+            self.wakeup.clear()
+            try:
+                job = self.claim()
+            except sqlite3.OperationalError:
+                # database is locked for longer than the timeout
+                if self.logger:
+                    self.logger.exception('jobs: claim failed')
+                job = None
+            if job is None:
+                self.wakeup.wait(self.poll)
+                continue
+            self.run(job)
+
+    def start(self, workers=None):
+        # worker threads start in the process serving requests (after fork)
+        if self.threads:
+            return
+        with self.start_lock:
+            if self.threads:
+                return
+            self.stopping.clear()
+            for n in range(workers or self.workers):
+                thread = threading.Thread(target=self._work, name=f'jobs-{n}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def stop(self, wait=True):
+        # a job being run is finished first
+        self.stopping.set()
+        self.wakeup.set()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+        self.threads = []
+
+    def _cleanup(self):
+        if time.time() - self.last_cleanup > CLEANUP_SECONDS:
+            self.last_cleanup = time.time()
+            self.purge(DONE, self.keep)
+
+    # inspecting
+    def counts(self):
+        rows = dict(self._connection().execute("SELECT state, count(*) FROM jobs GROUP BY state"))
+        return {state: rows.get(state, 0) for state in STATES}
+
+    def recent(self, state=None, limit=20):
+        query = "SELECT * FROM jobs"
+        params = ()
+        if state:
+            query += " WHERE state = ?"
+            params = (state,)
+        query += " ORDER BY id DESC LIMIT ?"
+        return [Job(*row) for row in self._connection().execute(query, params + (limit,))]
+
+    def retry(self, ids=None):
+        # failed jobs (all or these ids) are run again with new attempts
+        # a failed job is left as it is when the same key is waiting already
+        query = ("UPDATE OR IGNORE jobs SET state = 'queued', attempts = 0, run_at = ?, finished = NULL "
+                 "WHERE state = 'failed'")
+        params = (time.time(),)
+        if ids:
+            query += f" AND id IN ({', '.join('?' * len(ids))})"
+            params += tuple(ids)
+        count = self._connection().execute(query, params).rowcount
+        self.wakeup.set()
+        return count
+
+    def purge(self, state=DONE, older=0):
+        return self._connection().execute("DELETE FROM jobs WHERE state = ? AND finished < ?",
+                                          (state, time.time() - older)).rowcount
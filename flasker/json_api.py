@@ -0,0 +1,75 @@
+import json
+from datetime import date, datetime
+
+# Helpers of the JSON read API (/api/... views in app.py)
+# ?fields=id,title   only these fields, only their columns are selected
+# ?limit=100         items of one page, ?after=<next> the next page
+# a list is written while rows come from the db (yield_per), the whole page
+# is never built in memory:
+#   {"posts":[{...},{...}],"next":"<cursor>"}    next is null on the last page
+
+API_VERSION = '1'
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def dumps(value):
+    return json.dumps(value, default=_default, ensure_ascii=False, separators=(',', ':'))
+
+
+def parse_fields(value, allowed, default):
+    # "id,title" -> ['id', 'title'], ApiError for a field that isn't allowed
+    if not value:
+        return list(default)
+    fields = list(dict.fromkeys(f.strip() for f in value.split(',') if f.strip()))
+    unknown = [f for f in fields if f not in allowed]
+    if unknown or not fields:
+        raise ApiError(400, f"unknown fields: {', '.join(unknown)}; allowed: {', '.join(allowed)}")
+    return fields
+
+
+def parse_limit(value, default, maximum):
+    if value is None:
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ApiError(400, 'limit must be a number')
+    if not 1 <= limit <= maximum:
+        raise ApiError(400, f'limit must be 1..{maximum}')
+    return limit
+
+
+def stream_list(name, rows, fields, limit, next_cursor, batch=100):
+    # rows - result with the fields and one row more when there is a next page,
+    # next_cursor(row) - cursor after this row; json is yielded `batch` items at once
+    parts = ['{"' + name + '":[']
+    count = 0
+    last = None
+    try:
+        for row in rows:
+            if count == limit:
+                break
+            values = row._mapping
+            parts.append((',' if count else '') + dumps({field: values[field] for field in fields}))
+            count += 1
+            last = row
+            if len(parts) >= batch:
+                yield ''.join(parts)
+                parts = []
+        else:
+            last = None
+    finally:
+        rows.close()
+    parts.append('],"next":' + dumps(next_cursor(last) if last is not None else None) + '}')
+    yield ''.join(parts)
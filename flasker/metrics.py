@@ -0,0 +1,142 @@
+import hmac
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, abort, current_app, g, request, before_render_template, template_rendered
+from flask_login import current_user
+
+import query_counter
+
+# Request metrics in Prometheus text format on /metrics
+# https://prometheus.io/docs/instrumenting/exposition_formats/
+# for every endpoint: request time, template render time,
+# number and time of sql queries, and the slowest sql statements
+# /metrics shows sql text: only for the admin and for a scraper with
+# app.config['METRICS_TOKEN'] (Authorization: Bearer <token>, prometheus
+# bearer_token), 404 for others; no token - admin only
+# app.config['SERVER_TIMING'] = True adds Server-Timing header to responses,
+# every client sees the timings, for development
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SLOW_STATEMENTS = 10
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        total = 0
+        for le, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield f'{name}_bucket{{{labels},le="{le}"}} {total}'
+        yield f'{name}_sum{{{labels}}} {self.sum:.6f}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+class Metrics:
+    # name -> (help, buckets)
+    histograms = {
+        'flasker_request_seconds': ('Time of request', BUCKETS),
+        'flasker_template_seconds': ('Time of template render in request', BUCKETS),
+        'flasker_db_seconds': ('Time of sql queries in request', BUCKETS),
+        'flasker_db_queries': ('Number of sql queries in request', QUERY_BUCKETS),
+    }
+
+    def __init__(self, app=None):
+        self.data = {}
+        # (endpoint, statement) -> max seconds
+        self.slow = {}
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        before_render_template.connect(self._render_start, app)
+        template_rendered.connect(self._render_end, app)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+
+    def _start(self):
+        g.request_start = time.perf_counter()
+
+    def _render_start(self, sender, template, context, **extra):
+        g.render_start = time.perf_counter()
+
+    def _render_end(self, sender, template, context, **extra):
+        if 'render_start' in g:
+            g.template_time = g.get('template_time', 0.0) + time.perf_counter() - g.pop('render_start')
+
+    def observe(self, endpoint, values, slow):
+        with self.lock:
+            for name, value in values.items():
+                key = (name, endpoint)
+                if key not in self.data:
+                    self.data[key] = Histogram(self.histograms[name][1])
+                self.data[key].observe(value)
+            for duration, statement in slow:
+                key = (endpoint, statement)
+                if duration > self.slow.get(key, 0.0):
+                    self.slow[key] = duration
+            if len(self.slow) > SLOW_STATEMENTS:
+                top = sorted(self.slow.items(), key=lambda q: q[1], reverse=True)
+                self.slow = dict(top[:SLOW_STATEMENTS])
+
+    def _finish(self, response):
+        if 'request_start' not in g or request.endpoint in (None, 'metrics', 'static'):
+            return response
+        total = time.perf_counter() - g.request_start
+        template = g.get('template_time', 0.0)
+        db_time = query_counter.query_time()
+        db_count = query_counter.query_count()
+        self.observe(request.endpoint,
+                     {'flasker_request_seconds': total,
+                      'flasker_template_seconds': template,
+                      'flasker_db_seconds': db_time,
+                      'flasker_db_queries': db_count},
+                     query_counter.slow_queries())
+        if current_app.config.get('SERVER_TIMING'):
+            response.headers['Server-Timing'] = (
+                f'app;dur={total * 1000:.1f}, '
+                f'db;dur={db_time * 1000:.1f};desc="{db_count} queries", '
+                f'tpl;dur={template * 1000:.1f}')
+        return response
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, (help, buckets) in self.histograms.items():
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} histogram')
+                for (metric, endpoint), histogram in sorted(self.data.items()):
+                    if metric == name:
+                        lines.extend(histogram.lines(name, f'endpoint="{endpoint}"'))
+            lines.append('# HELP flasker_slow_query_seconds Slowest sql statements')
+            lines.append('# TYPE flasker_slow_query_seconds gauge')
+            for (endpoint, statement), duration in sorted(self.slow.items(), key=lambda q: q[1], reverse=True):
+                statement = ' '.join(statement.split())[:200].replace('\\', '\\\\').replace('"', '\\"')
+                lines.append(f'flasker_slow_query_seconds{{endpoint="{endpoint}",statement="{statement}"}} '
+                             f'{duration:.6f}')
+        return '\n'.join(lines) + '\n'
+
+    def allowed(self):
+        token = current_app.config.get('METRICS_TOKEN')
+        if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return True
+        return current_user.is_authenticated and current_user.id == 1
+
+    def view(self):
+        if not self.allowed():
+            abort(404)
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,279 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import g, request, session, make_response
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+from markupsafe import Markup
+
+# Response cache for rendered pages and template fragments
+# app.config['CACHE_BACKEND'] = 'filesystem' | 'memory' | None (off)
+#   filesystem - CACHE_DIR, shared by all workers of the host, a bump reaches
+#                every worker at once
+#   memory     - LRU of this process, for one worker: other workers would
+#                serve their pages up to CACHE_TTL after a bump
+# both keep at most CACHE_MAX_BYTES, the oldest entries go first
+#
+# every entry remembers the versions of its tags ('posts', 'post:5', 'user:2'),
+# bump('post:5') after commit makes all entries with this tag stale,
+# so there is no need to know the cache keys of a post
+#
+# full pages are cached only for anonymous users, the csrf token of the
+# search form in navbar is put back into the cached page on every hit
+
+CSRF_PLACEHOLDER = '\x00csrf\x00'
+CLEANUP_SECONDS = 300
+
+
+class MemoryBackend:
+    # LRU with ttl and cap on the total size of stored values
+    # bumps reach only this process
+    shared = False
+
+    def __init__(self, ttl=300, max_bytes=16 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.items = OrderedDict()
+        self.tags = {}
+        # tags never bumped in this process, a restart makes them new
+        self.started = time.time_ns()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                self._remove(key)
+                return None
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.items:
+                self._remove(key)
+            self.items[key] = (time.monotonic() + self.ttl, value)
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.items)))
+
+    def _remove(self, key):
+        expires, value = self.items.pop(key)
+        self.size -= len(value)
+
+    def tag_version(self, tag):
+        return self.tags.get(tag, self.started)
+
+    def bump(self, tag):
+        with self.lock:
+            self.tags[tag] = time.time_ns()
+
+
+class FileBackend:
+    # one file per entry, shared by all workers on the same host
+    # the size is checked every CLEANUP_SECONDS or after a quarter of
+    # max_bytes was written by this process
+    shared = True
+
+    def __init__(self, directory, ttl=300, max_bytes=16 * 1024 * 1024):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.written = 0
+        self.last_cleanup = time.time()
+        os.makedirs(os.path.join(directory, 'tags'), exist_ok=True)
+
+    def _path(self, *parts):
+        name = hashlib.sha1(parts[-1].encode()).hexdigest()
+        return os.path.join(self.directory, *parts[:-1], name)
+
+    def _write(self, path, data):
+        # write to tmp file and rename, readers never see half a file
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl < time.time():
+                os.remove(path)
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        self._write(self._path(key), value)
+        self.written += len(value)
+        self._cleanup()
+
+    def _cleanup(self):
+        # expired entries nobody asked for again, then the oldest over max_bytes
+        now = time.time()
+        if now - self.last_cleanup < CLEANUP_SECONDS and self.written < self.max_bytes // 4:
+            return
+        self.last_cleanup = now
+        self.written = 0
+        files = []
+        for entry in os.scandir(self.directory):
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if stat.st_mtime + self.ttl < now:
+                    os.remove(entry.path)
+                else:
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            except OSError:
+                pass
+        size = sum(f[1] for f in files)
+        for mtime, file_size, path in sorted(files):
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= file_size
+
+    def tag_version(self, tag):
+        try:
+            with open(self._path('tags', tag), 'rb') as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return 0
+
+    def bump(self, tag):
+        self._write(self._path('tags', tag), str(time.time_ns()).encode())
+
+
+class PageCache:
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        kind = app.config.get('CACHE_BACKEND')
+        ttl = app.config.get('CACHE_TTL', 300)
+        max_bytes = app.config.get('CACHE_MAX_BYTES', 16 * 1024 * 1024)
+        if kind == 'memory':
+            self.backend = MemoryBackend(ttl, max_bytes)
+        elif kind == 'filesystem':
+            self.backend = FileBackend(app.config['CACHE_DIR'], ttl, max_bytes)
+        app.jinja_env.globals['cached_fragment'] = self.fragment
+
+    # tags
+    def add_tags(self, *tags):
+        # tags of the page being rendered, version is taken before the data is read
+        if self.backend is None:
+            return
+        versions = g.setdefault('cache_tags', {})
+        for tag in tags:
+            versions.setdefault(tag, self.backend.tag_version(tag))
+
+    def bump(self, *tags):
+        # call after db commit
+        if self.backend is None:
+            return
+        for tag in tags:
+            self.backend.bump(tag)
+
+    def etag(self, key, *tags):
+        # validator of a response made from data with these tags, it changes
+        # with every bump; None when the cache is off or in memory, a worker
+        # that didn't see the bump would answer 304 with old data
+        if self.backend is None or not self.backend.shared:
+            return None
+        versions = ','.join(f'{tag}={self.backend.tag_version(tag)}' for tag in tags)
+        return hashlib.sha1(f'{key}|{versions}'.encode()).hexdigest()
+
+    def _load(self, key):
+        data = self.backend.get(key)
+        if data is None:
+            return None
+        entry = pickle.loads(data)
+        for tag, version in entry['tags'].items():
+            if self.backend.tag_version(tag) != version:
+                return None
+        return entry
+
+    def _store(self, key, body, tags):
+        entry = {'body': body,
+                 'tags': tags,
+                 'etag': hashlib.sha1(body.encode()).hexdigest(),
+                 'modified': datetime.now(timezone.utc).replace(microsecond=0)}
+        self.backend.set(key, pickle.dumps(entry, pickle.HIGHEST_PROTOCOL))
+        return entry
+
+    # template fragments
+    def fragment(self, name, *key, tags=(), caller=None):
+        # {% call cached_fragment('post', post.id, tags=['post:1']) %} ... {% endcall %}
+        if self.backend is None:
+            return caller()
+        # a cached page that holds this fragment gets stale with it
+        self.add_tags(*tags)
+        cache_key = 'fragment:' + name + ':' + ':'.join(str(k) for k in key)
+        versions = {tag: self.backend.tag_version(tag) for tag in tags}
+        entry = self._load(cache_key)
+        if entry is not None:
+            return Markup(entry['body'])
+        html = caller()
+        self._store(cache_key, str(html), versions)
+        return html
+
+    # full pages
+    def _response(self, entry):
+        body = entry['body'].replace(CSRF_PLACEHOLDER, generate_csrf())
+        response = make_response(body)
+        response.set_etag(entry['etag'], weak=True)
+        response.last_modified = entry['modified']
+        # browser must revalidate, it gets 304 while the page is the same
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    def _page_key(self, args, kwargs):
+        # endpoint, view arguments and only the query args the view reads,
+        # other query strings (?junk=1) don't make new entries
+        key = 'page:' + request.endpoint + ':' + ':'.join(f'{k}={v}' for k, v in sorted(kwargs.items()))
+        return key + '?' + '&'.join(f'{name}={request.args.get(name, "")}' for name in args)
+
+    def cached_page(self, *tags, args=()):
+        # cache GET pages for anonymous users, tags may use view arguments: 'post:{id}'
+        # args - query args the page depends on: cached_page('posts', args=['after'])
+        def decorator(view):
+            @wraps(view)
+            def wrapper(**kwargs):
+                if (self.backend is None or request.method != 'GET'
+                        or current_user.is_authenticated or session.get('_flashes')):
+                    return view(**kwargs)
+                key = self._page_key(args, kwargs)
+                entry = self._load(key)
+                if entry is not None:
+                    return self._response(entry)
+                self.add_tags(*(tag.format(**kwargs) for tag in tags))
+                rv = view(**kwargs)
+                if not isinstance(rv, str):
+                    return rv
+                token = g.get('csrf_token')
+                body = rv.replace(token, CSRF_PLACEHOLDER) if token else rv
+                return self._response(self._store(key, body, g.get('cache_tags', {})))
+            return wrapper
+        return decorator
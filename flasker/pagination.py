@@ -0,0 +1,52 @@
+import base64
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+# Keyset (cursor) pagination on (date_added, id)
+# next page = rows after the last row of this page, no OFFSET scans
+# https://use-the-index-luke.com/no-offset
+
+
+def encode_cursor(date_added, id):
+    raw = f"{date_added.isoformat()}|{id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    # return (date_added, id) or None for a broken cursor
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        date_added, id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(date_added), int(id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def keyset_query(query, date_column, id_column, cursor=None, per_page=10):
+    # Query or select() of one page, async views run it themselves
+    after = decode_cursor(cursor)
+    if after:
+        # row value comparison seeks in the (date_added, id) index,
+        # "a > x OR (a = x AND id > y)" walks the index from the start
+        query = query.filter(tuple_(date_column, id_column) > tuple_(after[0], after[1]))
+    # one extra row tells if there is a next page
+    return query.order_by(date_column, id_column).limit(per_page + 1)
+
+
+def split_page(items, date_column, id_column, per_page=10):
+    # return (items, next_cursor), next_cursor is None on the last page
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, date_column.key), getattr(last, id_column.key))
+    return items, next_cursor
+
+
+def keyset_page(query, date_column, id_column, cursor=None, per_page=10):
+    # return (items, next_cursor), next_cursor is None on the last page
+    items = keyset_query(query, date_column, id_column, cursor, per_page).all()
+    return split_page(items, date_column, id_column, per_page)
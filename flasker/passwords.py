@@ -0,0 +1,57 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# One place for password hashing
+# app.config['PASSWORD_METHOD'] - werkzeug method with its cost:
+#   'pbkdf2:sha256:600000' (iterations) or 'scrypt:32768:8:1' (n:r:p)
+# hashes made with other method or cost are upgraded on the next login
+#
+# hashing runs in a small thread pool (hashlib releases the gil), requests
+# over PASSWORD_QUEUE waiting get PasswordBusy instead of taking all threads
+
+
+class PasswordBusy(RuntimeError):
+    pass
+
+
+def hash_method(password_hash):
+    # 'pbkdf2:sha256:600000$salt$hash' -> 'pbkdf2:sha256:600000'
+    return password_hash.split('$', 1)[0]
+
+
+class PasswordPolicy:
+    def __init__(self, app=None):
+        self.method = 'pbkdf2:sha256:600000'
+        self.pool = None
+        self.slots = None
+        self.timeout = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.method = app.config.get('PASSWORD_METHOD', self.method)
+        workers = app.config.get('PASSWORD_WORKERS', 4)
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='passwords')
+        self.slots = threading.BoundedSemaphore(workers + app.config.get('PASSWORD_QUEUE', 32))
+        self.timeout = app.config.get('PASSWORD_TIMEOUT', 10)
+
+    def _run(self, func, *args):
+        if self.pool is None:
+            return func(*args)
+        if not self.slots.acquire(timeout=self.timeout):
+            raise PasswordBusy('too many password checks')
+        try:
+            return self.pool.submit(func, *args).result()
+        finally:
+            self.slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        return hash_method(password_hash) != self.method
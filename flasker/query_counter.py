@@ -0,0 +1,66 @@
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Count sql queries of every request
+# app.config['QUERY_BUDGETS'] = {'posts': 3, ...}  endpoint -> max queries
+# in debug mode a page over budget is logged, in testing mode it raises,
+# so a test that opens the page fails (test_query_budgets.py)
+# also keeps total time of the queries and the slowest of them for metrics
+
+SLOW_QUERIES = 3
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_count():
+    return g.get('query_count', 0)
+
+
+def query_time():
+    return g.get('query_time', 0.0)
+
+
+def slow_queries():
+    # [(seconds, statement), ...] slowest first
+    return g.get('slow_queries', [])
+
+
+def _before(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and conn.info.get('query_start'):
+        duration = time.perf_counter() - conn.info['query_start'].pop()
+        g.query_time = g.get('query_time', 0.0) + duration
+        slow = g.setdefault('slow_queries', [])
+        if len(slow) < SLOW_QUERIES or duration > slow[-1][0]:
+            slow.append((duration, statement))
+            slow.sort(key=lambda q: q[0], reverse=True)
+            del slow[SLOW_QUERIES:]
+
+
+def init_app(app, logger):
+    event.listen(Engine, 'before_cursor_execute', _before)
+    event.listen(Engine, 'after_cursor_execute', _after)
+
+    @app.after_request
+    def check_query_budget(response):
+        if not (app.debug or app.testing):
+            return response
+        count = query_count()
+        response.headers['X-Query-Count'] = str(count)
+        budget = app.config.get('QUERY_BUDGETS', {}).get(request.endpoint)
+        if budget is not None and count > budget:
+            message = f"{request.endpoint}: {count} queries, budget {budget}"
+            if app.testing:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
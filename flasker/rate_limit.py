@@ -0,0 +1,133 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request
+from flask_login import current_user
+
+from sqlite_local import LocalConnection
+
+# Rate limits for heavy views (password checks, search, uploads)
+# app.config['RATE_LIMIT_BACKEND'] = 'memory' | 'sqlite' | None (off)
+#   memory - buckets of this process, enough for one worker
+#   sqlite - buckets in a shared file (RATE_LIMIT_DB), all workers of the host
+# app.config['RATE_LIMITS'] = {'login': (10, 60), ...} - requests per seconds
+#
+# token bucket: a key gets `count` requests at once and one more every
+# period / count seconds; the key is the user id for logged in users,
+# the client ip for others
+# https://en.wikipedia.org/wiki/Token_bucket
+
+
+class RateLimited(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f'rate limit {name} exceeded, retry after {retry_after}s')
+        self.retry_after = retry_after
+
+
+def take_token(tokens, updated, now, rate, capacity):
+    # return (tokens left, seconds to wait), wait 0 - request is allowed
+    tokens = min(capacity, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / rate
+
+
+class MemoryBackend:
+    # LRU of buckets, the oldest bucket is the most refilled one, it goes first
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, capacity):
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (capacity, now))
+            tokens, wait = take_token(tokens, updated, now, rate, capacity)
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return wait
+
+
+class SQLiteBackend:
+    # one row per key, read and update in one write transaction
+    def __init__(self, path, prune_every=1000):
+        self.path = path
+        self.prune_every = prune_every
+        self.calls = 0
+        self._connection = LocalConnection(path, timeout=5)
+
+    def create_tables(self):
+        self._connection().execute("CREATE TABLE IF NOT EXISTS rate_buckets "
+                                   "(key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+
+    def take(self, key, rate, capacity):
+        connection = self._connection()
+        # wall clock, the file is shared by processes
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row or (capacity, now)
+            tokens, wait = take_token(tokens, updated, now, rate, capacity)
+            connection.execute("INSERT OR REPLACE INTO rate_buckets VALUES (?, ?, ?)", (key, tokens, now))
+            self.calls += 1
+            if self.calls % self.prune_every == 0:
+                # a bucket idle for an hour is full again, no need to keep it
+                connection.execute("DELETE FROM rate_buckets WHERE updated < ?", (now - 3600,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return wait
+
+
+class RateLimiter:
+    def __init__(self, app=None):
+        self.backend = None
+        self.limits = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        kind = app.config.get('RATE_LIMIT_BACKEND')
+        if kind == 'memory':
+            self.backend = MemoryBackend()
+        elif kind == 'sqlite':
+            self.backend = SQLiteBackend(app.config['RATE_LIMIT_DB'])
+        self.limits = app.config.get('RATE_LIMITS', {})
+
+    def create_tables(self):
+        # flask --app app init-db
+        if isinstance(self.backend, SQLiteBackend):
+            self.backend.create_tables()
+
+    def check(self, name, key):
+        # raise RateLimited when the key used up the limit `name`
+        if self.backend is None or name not in self.limits:
+            return
+        count, period = self.limits[name]
+        wait = self.backend.take(f'{name}:{key}', count / period, count)
+        if wait:
+            raise RateLimited(name, math.ceil(wait))
+
+    def client_key(self):
+        # behind a proxy remote_addr is the proxy, see werkzeug ProxyFix
+        if current_user.is_authenticated:
+            return f'user:{current_user.get_id()}'
+        return f'ip:{request.remote_addr}'
+
+    def limit(self, name, methods=('POST',)):
+        # @rate_limiter.limit('login') under @app.route, GET of the form is free
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if request.method in methods:
+                    self.check(name, self.client_key())
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
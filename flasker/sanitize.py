@@ -0,0 +1,97 @@
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urlparse
+
+# Clean html from CKEditor before it is shown with |safe
+# only tags and attributes from the lists are kept, <script> and <style>
+# are dropped with their text, links may be http(s), mailto or relative
+
+ALLOWED_TAGS = {
+    'a', 'abbr', 'b', 'blockquote', 'br', 'code', 'del', 'div', 'em', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'hr', 'i', 'img', 'li', 'ol', 'p', 'pre', 's', 'span', 'strong', 'sub', 'sup', 'table', 'tbody',
+    'td', 'tfoot', 'th', 'thead', 'tr', 'u', 'ul',
+}
+ALLOWED_ATTRS = {
+    'a': {'href', 'title', 'target'},
+    'img': {'src', 'alt', 'title', 'width', 'height'},
+    'td': {'colspan', 'rowspan'},
+    'th': {'colspan', 'rowspan'},
+}
+URL_ATTRS = {'href', 'src'}
+URL_SCHEMES = {'', 'http', 'https', 'mailto'}
+VOID_TAGS = {'br', 'hr', 'img'}
+# embed has no end tag, as an unknown tag it goes alone
+DROP_CONTENT = {'script', 'style', 'iframe', 'object', 'template'}
+# browsers skip these around a url and tab / newline inside it: "\x01java\tscript:"
+URL_STRIP = ''.join(chr(c) for c in range(0x21))
+URL_REMOVE = str.maketrans('', '', '\t\n\r')
+
+
+def url_scheme(value):
+    return urlparse(value.strip(URL_STRIP).translate(URL_REMOVE)).scheme.lower()
+
+
+class Sanitizer(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self.text = []
+        self.open_tags = []
+        self.skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT:
+            self.skip += 1
+            return
+        if self.skip or tag not in ALLOWED_TAGS:
+            return
+        allowed = ALLOWED_ATTRS.get(tag, set())
+        parts = [tag]
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            if name in URL_ATTRS and url_scheme(value) not in URL_SCHEMES:
+                continue
+            parts.append(f'{name}="{escape(value)}"')
+        if tag == 'a' and 'target' in dict(attrs):
+            parts.append('rel="noopener noreferrer"')
+        self.out.append(f"<{' '.join(parts)}>")
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        # <script/> has no content to skip
+        if tag not in DROP_CONTENT:
+            self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT:
+            self.skip = max(self.skip - 1, 0)
+            return
+        if self.skip or tag not in self.open_tags:
+            return
+        # close tags left open inside this one
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.out.append(f'</{open_tag}>')
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self.skip:
+            return
+        self.out.append(escape(data, quote=False))
+        self.text.append(data)
+
+    def close(self):
+        super().close()
+        while self.open_tags:
+            self.out.append(f'</{self.open_tags.pop()}>')
+
+
+def clean(html):
+    # return (safe html, plain text)
+    parser = Sanitizer()
+    parser.feed(html or '')
+    parser.close()
+    return ''.join(parser.out), ' '.join(' '.join(parser.text).split())
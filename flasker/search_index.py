@@ -0,0 +1,176 @@
+import re
+from html import unescape
+
+from markupsafe import Markup, escape
+from sqlalchemy import event, select, text
+from sqlalchemy.orm import object_session
+
+# Full-text search over Posts
+# https://www.sqlite.org/fts5.html
+# posts_fts keeps title and the text of content (html tags stripped),
+# rowid of the index == Posts.id
+
+FTS_TABLE = 'posts_fts'
+# snippet markers, replaced with <mark> after html escape
+MARK_START = '\x02'
+MARK_END = '\x03'
+SNIPPET_TOKENS = 24
+
+TAG_RE = re.compile(r'<[^>]+>')
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# False when the db isn't sqlite, sqlite is built without fts5 or the index
+# is not created yet (flask --app app init-db), then search uses LIKE;
+# None - not checked yet
+enabled = None
+
+
+def strip_html(html):
+    # "<p>Hello&nbsp;<b>World</b></p>" -> "Hello World"
+    return ' '.join(unescape(TAG_RE.sub(' ', html or '')).split())
+
+
+def make_query(term):
+    # every word of the term as quoted prefix: foo bar -> "foo"* "bar"*
+    words = WORD_RE.findall(term or '')
+    return ' '.join(f'"{w}"*' for w in words)
+
+
+def highlight(snippet):
+    return Markup(escape(snippet)
+                  .replace(MARK_START, Markup('<mark>'))
+                  .replace(MARK_END, Markup('</mark>')))
+
+
+def is_enabled(connection):
+    # the schema is made by init-db, not on import, so look for the table once
+    global enabled
+    if enabled is None and connection.dialect.name != 'sqlite':
+        enabled = False
+    if enabled is None:
+        enabled = connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"),
+                                     {'name': FTS_TABLE}).first() is not None
+    return enabled
+
+
+def create_index(connection):
+    # create the index table, new index is filled from existing posts
+    global enabled
+    # fts5 is sqlite only, other databases search with LIKE
+    if connection.dialect.name != 'sqlite':
+        enabled = False
+        return enabled
+    exists = connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"),
+                                {'name': FTS_TABLE}).first()
+    try:
+        connection.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+            f"USING fts5(title, body, tokenize='unicode61 remove_diacritics 2')"))
+        enabled = True
+    except Exception:
+        enabled = False
+        return enabled
+    if not exists:
+        rebuild(connection)
+    return enabled
+
+
+def index_post(connection, post_id, title, content):
+    if not is_enabled(connection):
+        return
+    connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {'id': post_id})
+    connection.execute(text(f"INSERT INTO {FTS_TABLE} (rowid, title, body) VALUES (:id, :title, :body)"),
+                       {'id': post_id, 'title': title, 'body': strip_html(content)})
+
+
+def index_new_posts(connection, rows):
+    # rows: [(id, title, content), ...] of just inserted posts
+    if not rows or not is_enabled(connection):
+        return
+    connection.execute(text(f"INSERT INTO {FTS_TABLE} (rowid, title, body) VALUES (:id, :title, :body)"),
+                       [{'id': id, 'title': title, 'body': strip_html(content)} for id, title, content in rows])
+
+
+def remove_post(connection, post_id):
+    if not is_enabled(connection):
+        return
+    connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {'id': post_id})
+
+
+def rebuild(connection, batch=1000):
+    # fill the index from posts table, for existing databases
+    connection.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    last_id = 0
+    count = 0
+    while True:
+        rows = connection.execute(text("SELECT id, title, content FROM posts "
+                                       "WHERE id > :last ORDER BY id LIMIT :batch"),
+                                  {'last': last_id, 'batch': batch}).all()
+        if not rows:
+            break
+        connection.execute(text(f"INSERT INTO {FTS_TABLE} (rowid, title, body) VALUES (:id, :title, :body)"),
+                           [{'id': r.id, 'title': r.title, 'body': strip_html(r.content)} for r in rows])
+        last_id = rows[-1].id
+        count += len(rows)
+    return count
+
+
+def listen(model, defer=None):
+    # keep the index in the same transaction as the posts row, or with
+    # defer(session, post_id) index it later with update_post()
+    @event.listens_for(model, 'after_insert')
+    def after_insert(mapper, connection, target):
+        if defer:
+            defer(object_session(target), target.id)
+        else:
+            index_post(connection, target.id, target.title, target.content)
+
+    @event.listens_for(model, 'after_update')
+    def after_update(mapper, connection, target):
+        if defer:
+            defer(object_session(target), target.id)
+        else:
+            index_post(connection, target.id, target.title, target.content)
+
+    @event.listens_for(model, 'after_delete')
+    def after_delete(mapper, connection, target):
+        if defer:
+            defer(object_session(target), target.id)
+        else:
+            remove_post(connection, target.id)
+
+
+def update_post(session, model, post_id):
+    # index the post as it is now, a deleted post is removed
+    connection = session.connection()
+    row = session.execute(select(model.title, model.content).where(model.id == post_id)).first()
+    if row is None:
+        remove_post(connection, post_id)
+    else:
+        index_post(connection, post_id, row.title, row.content)
+
+
+def search(session, model, term, limit=50, options=()):
+    # return list of (post, snippet) ordered by rank
+    # options - loader options for posts query, e.g. joinedload(Posts.poster)
+    # only session is used, async views call it with AsyncSession.run_sync
+    if not is_enabled(session.connection()):
+        posts = session.scalars(select(model).options(*options)
+                                .where(model.content.like('%' + term + '%'))
+                                .order_by(model.title)
+                                .limit(limit)).unique().all()
+        return [(p, None) for p in posts]
+    query = make_query(term)
+    if not query:
+        return []
+    rows = session.execute(text(
+        f"SELECT rowid, snippet({FTS_TABLE}, 1, :start, :end, '...', :tokens) AS snip "
+        f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :query "
+        f"ORDER BY bm25({FTS_TABLE}, 10.0, 1.0) LIMIT :limit"),
+        {'start': MARK_START, 'end': MARK_END, 'tokens': SNIPPET_TOKENS,
+         'query': query, 'limit': limit}).all()
+    if not rows:
+        return []
+    posts = {p.id: p for p in session.scalars(select(model).options(*options)
+                                              .where(model.id.in_([r.rowid for r in rows]))).unique()}
+    return [(posts[r.rowid], highlight(r.snip)) for r in rows if r.rowid in posts]
@@ -0,0 +1,157 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+
+from sqlite_local import LocalConnection
+
+# Sessions kept on the server, the cookie has only a random id
+# app.config['SESSION_BACKEND'] = 'sqlite' | 'memory' | None (flask signed cookie)
+#   sqlite - SESSION_DB file, shared by all workers of the host
+#   memory - LRU of SESSION_MAX_ENTRIES in this process, for one worker
+# https://flask.palletsprojects.com/en/2.3.x/api/#session-interface
+#
+# nothing is signed or written when the session didn't change; expiry is
+# moved forward only when half of the lifetime is gone, expired rows are
+# skipped on read and deleted together every CLEANUP_SECONDS
+
+ID_BYTES = 24
+CLEANUP_SECONDS = 300
+serializer = TaggedJSONSerializer()
+
+
+class ServerSession(SecureCookieSession):
+    def __init__(self, initial=None, sid=None, expires=0.0):
+        super().__init__(initial)
+        self.sid = sid
+        self.expires = expires
+        # the id is changed on login / logout
+        self.user_id = self.get('_user_id')
+        self.accessed = False
+
+
+class MemoryStore:
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, sid):
+        # return (data, expires) or None
+        with self.lock:
+            item = self.items.get(sid)
+            if item is None or item[1] < time.time():
+                return None
+            self.items.move_to_end(sid)
+            return item
+
+    def set(self, sid, data, expires):
+        with self.lock:
+            self.items[sid] = (data, expires)
+            self.items.move_to_end(sid)
+            while len(self.items) > self.max_entries:
+                self.items.popitem(last=False)
+
+    def delete(self, sid):
+        with self.lock:
+            self.items.pop(sid, None)
+
+    def cleanup(self):
+        now = time.time()
+        with self.lock:
+            expired = [sid for sid, (data, expires) in self.items.items() if expires < now]
+            for sid in expired:
+                del self.items[sid]
+        return len(expired)
+
+
+class SQLiteStore:
+    def __init__(self, path):
+        self._connection = LocalConnection(path, timeout=30)
+
+    def create_tables(self):
+        connection = self._connection()
+        connection.execute("CREATE TABLE IF NOT EXISTS sessions "
+                           "(id TEXT PRIMARY KEY, data BLOB NOT NULL, expires REAL NOT NULL) WITHOUT ROWID")
+        connection.execute("CREATE INDEX IF NOT EXISTS ix_sessions_expires ON sessions (expires)")
+
+    def get(self, sid):
+        return self._connection().execute("SELECT data, expires FROM sessions WHERE id = ? AND expires >= ?",
+                                          (sid, time.time())).fetchone()
+
+    def set(self, sid, data, expires):
+        self._connection().execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)", (sid, data, expires))
+
+    def delete(self, sid):
+        self._connection().execute("DELETE FROM sessions WHERE id = ?", (sid,))
+
+    def cleanup(self):
+        return self._connection().execute("DELETE FROM sessions WHERE expires < ?", (time.time(),)).rowcount
+
+
+class ServerSessionInterface(SessionInterface):
+    def __init__(self, store):
+        self.store = store
+        self.last_cleanup = time.time()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            item = self.store.get(sid)
+            if item is not None:
+                return ServerSession(serializer.loads(item[0]), sid, item[1])
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        cookie = {'domain': self.get_cookie_domain(app), 'path': self.get_cookie_path(app),
+                  'secure': self.get_cookie_secure(app), 'samesite': self.get_cookie_samesite(app),
+                  'httponly': self.get_cookie_httponly(app)}
+        if session.accessed:
+            response.vary.add('Cookie')
+        self._cleanup()
+        if not session:
+            if session.sid is not None:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, **cookie)
+                response.vary.add('Cookie')
+            return
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        now = time.time()
+        new_id = session.sid is None or session.get('_user_id') != session.user_id
+        if not new_id and not session.modified and session.expires - now > lifetime / 2:
+            return
+        if new_id:
+            # a new id after login, so an id known before it is useless
+            if session.sid is not None:
+                self.store.delete(session.sid)
+            session.sid = secrets.token_urlsafe(ID_BYTES)
+        self.store.set(session.sid, serializer.dumps(dict(session)), now + lifetime)
+        response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session), **cookie)
+        response.vary.add('Cookie')
+
+    def _cleanup(self):
+        if time.time() - self.last_cleanup > CLEANUP_SECONDS:
+            self.last_cleanup = time.time()
+            self.store.cleanup()
+
+
+def init_app(app):
+    kind = app.config.get('SESSION_BACKEND')
+    if kind == 'memory':
+        store = MemoryStore(app.config.get('SESSION_MAX_ENTRIES', 100000))
+    elif kind == 'sqlite':
+        store = SQLiteStore(app.config['SESSION_DB'])
+    else:
+        return
+    app.session_interface = ServerSessionInterface(store)
+
+
+def create_tables(app):
+    # flask --app app init-db
+    store = getattr(app.session_interface, 'store', None)
+    if isinstance(store, SQLiteStore):
+        store.create_tables()
@@ -0,0 +1,62 @@
+import re
+import threading
+from collections import OrderedDict
+
+# Slugs of post urls: /posts/<slug>
+# SlugCache keeps slug -> post id of this process, so a post page by slug
+# makes the same single query by primary key as /posts/<id>
+# call invalidate(slug) after commit of a changed or deleted slug; other
+# workers find out on the next hit, the loaded post has another slug
+
+NOT_SLUG_RE = re.compile(r'[^\w]+')
+
+
+def slugify(text):
+    slug = NOT_SLUG_RE.sub('-', text.strip().lower()).strip('-_')[:240]
+    if not slug:
+        return 'post'
+    # /posts/<int:id> takes all digits
+    if slug.isdigit():
+        return 'post-' + slug
+    return slug
+
+
+class SlugCache:
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.ids = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, slug):
+        with self.lock:
+            id = self.ids.get(slug)
+            if id is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.ids.move_to_end(slug)
+            return id
+
+    def put(self, slug, id):
+        with self.lock:
+            self.ids[slug] = id
+            self.ids.move_to_end(slug)
+            while len(self.ids) > self.max_size:
+                self.ids.popitem(last=False)
+
+    def invalidate(self, *slugs):
+        with self.lock:
+            for slug in slugs:
+                self.invalidations += 1
+                self.ids.pop(slug, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'size': len(self.ids),
+                'hit_rate': self.hits / total if total else 0.0}
@@ -0,0 +1,28 @@
+import os
+import sqlite3
+import threading
+
+# One connection per thread to a small sqlite file next to the app db
+# (jobs, server sessions, rate limit buckets), shared by the workers of the host
+# autocommit, WAL: readers don't wait for the writer
+# the tables are made by `flask --app app init-db`, not on import
+#
+# connection = LocalConnection(path, timeout=30)
+# connection().execute(...)
+
+
+class LocalConnection:
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def __call__(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            self.local.connection = connection
+        return connection
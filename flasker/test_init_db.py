@@ -0,0 +1,57 @@
+# init-db upgrades a database made by the first version of the app: adds the
+# columns of the models since, fills the post bodies, pages work after it
+# python -m pytest test_init_db.py
+import os
+import sqlite3
+import subprocess
+import sys
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+
+# the tables as the first app.py made them
+BASELINE = """
+CREATE TABLE user (
+    id INTEGER NOT NULL, username VARCHAR(20) NOT NULL, name VARCHAR(100) NOT NULL,
+    email VARCHAR(100) NOT NULL, favorite_color VARCHAR(100), about_author TEXT(500),
+    date_added DATETIME, profile_pic VARCHAR, password_hash VARCHAR(100) NOT NULL,
+    PRIMARY KEY (id), UNIQUE (username), UNIQUE (email));
+CREATE TABLE posts (
+    id INTEGER NOT NULL, title VARCHAR(255) NOT NULL, content TEXT NOT NULL, date_added DATETIME,
+    slug VARCHAR(255) NOT NULL, poster_id INTEGER,
+    PRIMARY KEY (id), FOREIGN KEY(poster_id) REFERENCES user (id));
+INSERT INTO user VALUES (1, 'old', 'Old', 'old@example.com', 'red', '', '2023-05-01 10:00:00', NULL, 'x');
+INSERT INTO posts VALUES (1, 'First', '<p>first <b>post</b></p>', '2023-05-01 10:00:00', 'My Post', 1);
+INSERT INTO posts VALUES (2, 'Second', '<p>second</p>', '2023-05-02 10:00:00', 'second', NULL);
+"""
+
+CHILD = """
+import app as A
+client = A.app.test_client()
+print(*[client.get(path).status_code for path in ('/posts', '/posts/1', '/posts/my-post', '/posts/second')])
+"""
+
+
+def columns(path, table):
+    with sqlite3.connect(path) as conn:
+        return {row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')}
+
+
+def test_upgrade_baseline(tmp_path):
+    path = str(tmp_path / 'old.db')
+    with sqlite3.connect(path) as conn:
+        conn.executescript(BASELINE)
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + path, JOBS_DB=str(tmp_path / 'jobs.db'),
+               JOBS_WORKERS='0', CACHE_BACKEND='', RATE_LIMIT_BACKEND='', SESSION_BACKEND='memory',
+               LOG_FILE=str(tmp_path / 'test.log'))
+    for _ in range(2):
+        # the second run has nothing to do
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'init-db'], cwd=BASE_DIR, env=env,
+                       check=True, capture_output=True)
+    assert {'body_html', 'body_text', 'excerpt'} <= columns(path, 'posts')
+    assert 'profile_pic_ready' in columns(path, 'user')
+    with sqlite3.connect(path) as conn:
+        assert conn.execute('SELECT body_text, excerpt FROM posts WHERE id = 1').fetchone() == ('first post',
+                                                                                              'first post')
+    out = subprocess.run([sys.executable, '-c', CHILD], cwd=BASE_DIR, env=env, check=True,
+                         capture_output=True, text=True).stdout
+    assert out.split()[-4:] == ['200', '200', '200', '200']
@@ -0,0 +1,84 @@
+# pages stay within QUERY_BUDGETS of app.py: in testing mode a page over
+# its budget raises QueryBudgetExceeded, so the request here fails
+# python -m pytest test_query_budgets.py
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+TMP = tempfile.mkdtemp()
+# the app reads these on import; pages must reach the db, no page cache
+os.environ.update(DATABASE_URL='sqlite:///' + os.path.join(TMP, 'test.db'),
+                  JOBS_DB=os.path.join(TMP, 'jobs.db'), JOBS_WORKERS='0',
+                  CACHE_BACKEND='', RATE_LIMIT_BACKEND='', SESSION_BACKEND='memory',
+                  LOG_FILE=os.path.join(TMP, 'test.log'))
+sys.path.insert(0, BASE_DIR)
+
+import app as A  # noqa: E402
+import search_index  # noqa: E402
+from bench_routes import PASSWORD, seed  # noqa: E402
+
+USERS = 20
+POSTS = 200
+
+
+@pytest.fixture(scope='module', autouse=True)
+def seeded():
+    A.app.testing = True
+    A.app.config['WTF_CSRF_ENABLED'] = False
+    seed(A, USERS, POSTS)
+    yield
+    shutil.rmtree(TMP, ignore_errors=True)
+
+
+@pytest.fixture(params=['anonymous', 'logged in'])
+def client(request):
+    client = A.app.test_client()
+    if request.param == 'logged in':
+        client.post('/login', data={'username': 'user1', 'password': PASSWORD})
+    return client
+
+
+def within_budget(response, endpoint):
+    assert response.status_code == 200
+    count = int(response.headers['X-Query-Count'])
+    assert count <= A.app.config['QUERY_BUDGETS'][endpoint], f'{endpoint}: {count} queries'
+    return response
+
+
+def test_posts(client):
+    body = within_budget(client.get('/posts'), 'posts').get_data(as_text=True)
+    after = re.search(r'after=([\w-]+)', body).group(1)
+    within_budget(client.get('/posts?after=' + after), 'posts')
+
+
+def test_post(client):
+    for id in (1, POSTS // 2, POSTS):
+        within_budget(client.get(f'/posts/{id}'), 'post')
+
+
+@pytest.fixture(scope='module')
+def orphan_post():
+    # the poster was deleted (poster_id NULL) or the post was imported without one
+    with A.app.app_context():
+        post = A.Posts(title='Orphan', content='<p>nobody wrote this</p>', slug='orphan', poster_id=None)
+        A.db.session.add(post)
+        A.db.session.commit()
+        return post.id
+
+
+def test_post_without_poster(client, orphan_post):
+    for path in (f'/posts/{orphan_post}', '/posts/orphan'):
+        body = within_budget(client.get(path), 'post').get_data(as_text=True)
+        assert 'default_user.jpg' in body
+
+
+@pytest.mark.parametrize('fts', [True, False])
+def test_search(client, fts, monkeypatch):
+    # without fts5 search falls back to LIKE
+    monkeypatch.setattr(search_index, 'enabled', search_index.enabled and fts)
+    within_budget(client.post('/search', data={'searched': 'sqlite template'}), 'search')
@@ -0,0 +1,82 @@
+# sanitize.clean is all that stands between user html and |safe
+# (post page, listings, body_html of the api)
+# python -m pytest test_sanitize.py
+import pytest
+
+from sanitize import clean
+
+
+def html(source):
+    return clean(source)[0]
+
+
+@pytest.mark.parametrize('href', [
+    'javascript:alert(1)',
+    'JaVaScRiPt:alert(1)',
+    ' javascript:alert(1)',
+    'java\tscript:alert(1)',
+    'java&#x0A;script:alert(1)',
+    '\x01javascript:alert(1)',
+    '&#1;javascript:alert(1)',
+    '&#106;avascript:alert(1)',
+    'vbscript:msgbox(1)',
+    'data:text/html,<script>alert(1)</script>',
+])
+def test_bad_urls(href):
+    assert html(f'<a href="{href}">x</a>') == '<a>x</a>'
+    assert html(f'<img src="{href}">') == '<img>'
+
+
+@pytest.mark.parametrize('href', ['https://example.com/a?b=1&amp;c=2', '/posts/1', 'mailto:a@example.com', '#top'])
+def test_good_urls(href):
+    assert html(f'<a href="{href}">x</a>') == f'<a href="{href}">x</a>'
+
+
+def test_event_attributes():
+    assert html('<p onclick="alert(1)" onmouseover="alert(1)">t</p>') == '<p>t</p>'
+    assert html('<img src="/a.png" onerror="alert(1)">') == '<img src="/a.png">'
+    assert html('<a href="/" style="x" class="y" id="z">t</a>') == '<a href="/">t</a>'
+
+
+def test_attribute_quotes():
+    assert html('<a title=\'" onclick="alert(1)\'>t</a>') == '<a title="&quot; onclick=&quot;alert(1)">t</a>'
+
+
+@pytest.mark.parametrize('source', [
+    '<script>alert(1)</script>ok',
+    '<script type="text/javascript">document.write("<b>x</b>")</script>ok',
+    '<style>body { display: none }</style>ok',
+    '<iframe src="https://example.com">inner <b>text</b></iframe>ok',
+    '<object data="x.swf"><param name="a">inner</object>ok',
+])
+def test_dropped_with_content(source):
+    body, text = clean(source)
+    assert body == 'ok'
+    assert text == 'ok'
+
+
+def test_unknown_tags_keep_text():
+    assert html('<p>a <embed src="x.swf"> b <form><input name="q">c</form></p>') == '<p>a  b c</p>'
+
+
+@pytest.mark.parametrize('source, expected', [
+    ('<p><b>bold', '<p><b>bold</b></p>'),
+    ('<div><p>a</div>b', '<div><p>a</p></div>b'),
+    ('text</p></div>', 'text'),
+    ('<p>&lt;script&gt; 1 < 2</p>', '<p>&lt;script&gt; 1 &lt; 2</p>'),
+])
+def test_tags_closed(source, expected):
+    assert html(source) == expected
+
+
+def test_target_links_get_rel():
+    assert (html('<a href="/x" target="_blank">x</a>')
+            == '<a href="/x" target="_blank" rel="noopener noreferrer">x</a>')
+    # a rel of the author is not kept
+    assert (html('<a href="/x" target="_blank" rel="opener">x</a>')
+            == '<a href="/x" target="_blank" rel="noopener noreferrer">x</a>')
+    assert html('<a href="/x">x</a>') == '<a href="/x">x</a>'
+
+
+def test_plain_text():
+    assert clean('<p>Hello&nbsp;<b>World</b></p>\n<p>again</p>')[1] == 'Hello World again'
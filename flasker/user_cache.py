@@ -0,0 +1,61 @@
+import threading
+import time
+
+from sqlalchemy.orm import make_transient_to_detached
+
+# Cache of logged in users for load_user()
+# the row is kept as dict of column values for a short time, on hit the user
+# is put into the db session without sql, so the session identity map
+# answers all other User.query.get(id) of this request
+# call invalidate(id) after commit of any change of the user
+
+
+class UserCache:
+    def __init__(self, ttl=30, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.rows = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def load(self, session, model, id):
+        with self.lock:
+            row = self.rows.get(id)
+            if row is not None and row[0] < time.monotonic():
+                del self.rows[id]
+                row = None
+        if row is None:
+            self.misses += 1
+            user = session.get(model, id)
+            if user is not None:
+                self.put(user)
+            return user
+        self.hits += 1
+        user = model.__mapper__.class_manager.new_instance()
+        for key, value in row[1].items():
+            setattr(user, key, value)
+        make_transient_to_detached(user)
+        # returns the user already loaded in this request, if there is one
+        return session.merge(user, load=False)
+
+    def put(self, user):
+        values = {attr.key: getattr(user, attr.key) for attr in user.__mapper__.column_attrs}
+        with self.lock:
+            if len(self.rows) >= self.max_size:
+                self.rows.clear()
+            self.rows[user.id] = (time.monotonic() + self.ttl, values)
+
+    def invalidate(self, id):
+        with self.lock:
+            self.invalidations += 1
+            self.rows.pop(id, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'size': len(self.rows),
+                'hit_rate': self.hits / total if total else 0.0}